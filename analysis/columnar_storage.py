@@ -0,0 +1,191 @@
+"""
+Columnar storage for API predictions and processed (matched) results.
+
+Tables are flat: boxes are split into x1/y1/x2/y2 columns (NaN when a box is
+missing) and string columns (image, labels) are dictionary encoded. They are
+saved as Parquet (.parquet, needs pyarrow) or as compressed NumPy archives
+(.npz), and load straight into DataFrames or column arrays without building
+per-row Python objects.
+
+The JSON files written by the previous versions of the analysis scripts can be
+converted in both directions:
+    python columnar_storage.py predictions.json predictions.parquet
+    python columnar_storage.py processed.parquet processed.json
+"""
+import argparse
+import json
+import os
+import numpy as np
+import pandas as pd
+
+BOX_KEYS = ["x1", "y1", "x2", "y2"]
+PREDICTION_SCORE_COLUMNS = ["confidence", "cls_score", "damaged_score", "healthy_score"]
+RESULT_SCORE_COLUMNS = ["score", "iou", "confidence"]
+PREDICTION_CATEGORY_COLUMNS = ["image"]
+RESULT_CATEGORY_COLUMNS = ["image", "actual", "predicted_label"]
+COLUMNAR_EXTENSIONS = (".parquet", ".npz")
+
+def is_columnar_path(path: str) -> bool:
+    return path.lower().endswith(COLUMNAR_EXTENSIONS)
+
+def box_columns(prefix: str, boxes: list) -> dict[str, np.ndarray]:
+    """Split a list of box dicts (or None) into float columns, NaN where the box is missing."""
+    columns = {f"{prefix}{key}": np.full(len(boxes), np.nan) for key in BOX_KEYS}
+    for i, box in enumerate(boxes):
+        if box:
+            for key in BOX_KEYS:
+                columns[f"{prefix}{key}"][i] = box[key]
+    return columns
+
+def categorize(df: pd.DataFrame, columns: list[str]) -> pd.DataFrame:
+    for column in columns:
+        df[column] = df[column].astype("category")
+    return df
+
+def predictions_to_frame(items: list[dict]) -> pd.DataFrame:
+    """Flat table of API prediction dicts (APIResponse.to_dict format)."""
+    data = {"image": [item.get("image", "") for item in items]}
+    data.update(box_columns("", [item["box"] for item in items]))
+    for column in PREDICTION_SCORE_COLUMNS:
+        data[column] = np.array([item.get(column, 0.0) for item in items], dtype=float)
+    return categorize(pd.DataFrame(data), PREDICTION_CATEGORY_COLUMNS)
+
+def processed_results_to_frame(items: list[dict]) -> pd.DataFrame:
+    """Flat table of processed result dicts (ObjectPrediction.to_dict format)."""
+    data = {
+        "image": [item.get("image", "") for item in items],
+        "actual": [item.get("actual", "") for item in items],
+        "predicted_label": [item.get("predicted_label", "") for item in items],
+    }
+    data.update(box_columns("actual_", [item.get("actual_bbox") for item in items]))
+    data.update(box_columns("predicted_", [item.get("predicted_bbox") for item in items]))
+    for column in RESULT_SCORE_COLUMNS:
+        data[column] = np.array([item.get(column, 0.0) for item in items], dtype=float)
+    return categorize(pd.DataFrame(data), RESULT_CATEGORY_COLUMNS)
+
+def save_frame(df: pd.DataFrame, path: str):
+    """Save a table as Parquet or .npz, depending on the extension of `path`."""
+    if path.lower().endswith(".parquet"):
+        # Categorical columns are written as Arrow dictionary arrays
+        df.to_parquet(path, index=False)
+        return
+    arrays = {}
+    for column in df.columns:
+        values = df[column]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            arrays[f"{column}.codes"] = values.cat.codes.to_numpy()
+            arrays[f"{column}.categories"] = values.cat.categories.to_numpy(dtype=str)
+        else:
+            arrays[column] = values.to_numpy()
+    np.savez_compressed(path, **arrays)
+
+def load_arrays(path: str) -> dict[str, np.ndarray]:
+    """
+    Load a columnar table as {column: array}. Dictionary encoded columns are returned as
+    `<column>.codes` and `<column>.categories`, so labels can be compared as small integers.
+    """
+    if path.lower().endswith(".parquet"):
+        import pyarrow.parquet as pq
+        table = pq.read_table(path)
+        arrays = {}
+        for name, column in zip(table.column_names, table.columns):
+            column = column.combine_chunks()
+            if hasattr(column, "dictionary"):
+                arrays[f"{name}.codes"] = column.indices.to_numpy(zero_copy_only=False)
+                arrays[f"{name}.categories"] = column.dictionary.to_numpy(zero_copy_only=False).astype(str)
+            else:
+                arrays[name] = column.to_numpy(zero_copy_only=False)
+        return arrays
+    with np.load(path) as archive:
+        return {name: archive[name] for name in archive.files}
+
+def load_frame(path: str) -> pd.DataFrame:
+    """Load a Parquet or .npz table into a DataFrame, keeping dictionary encoded columns categorical."""
+    if path.lower().endswith(".parquet"):
+        return pd.read_parquet(path)
+    arrays = load_arrays(path)
+    data = {}
+    for name, values in arrays.items():
+        if name.endswith(".categories"):
+            continue
+        if name.endswith(".codes"):
+            column = name[:-len(".codes")]
+            data[column] = pd.Categorical.from_codes(values, categories=arrays[f"{column}.categories"])
+        else:
+            data[name] = values
+    return pd.DataFrame(data)
+
+def load_predictions_frame(path: str) -> pd.DataFrame:
+    """API predictions as a flat table, from a columnar file or from the JSON / JSON Lines formats."""
+    if is_columnar_path(path):
+        return load_frame(path)
+    from process_predictions import iter_api_prediction_items
+    return predictions_to_frame(list(iter_api_prediction_items(path)))
+
+def load_processed_results_frame(path: str) -> pd.DataFrame:
+    """Processed results as a flat table, from a columnar file or from the JSON format."""
+    if is_columnar_path(path):
+        return load_frame(path)
+    with open(path, "r") as f:
+        return processed_results_to_frame(json.load(f))
+
+def json_number(value: float):
+    """Boxes are integer pixels in the JSON files, so integral floats are written back as ints."""
+    return int(value) if float(value).is_integer() else float(value)
+
+def frame_box(row: dict, prefix: str):
+    if np.isnan(row[f"{prefix}x1"]):
+        return None
+    return {key: json_number(row[f"{prefix}{key}"]) for key in BOX_KEYS}
+
+def predictions_frame_to_json(df: pd.DataFrame) -> list[dict]:
+    return [
+        {
+            "image": row["image"],
+            "box": frame_box(row, ""),
+            **{column: row[column] for column in PREDICTION_SCORE_COLUMNS},
+        }
+        for row in df.to_dict("records")
+    ]
+
+def processed_results_frame_to_json(df: pd.DataFrame) -> list[dict]:
+    return [
+        {
+            "image": row["image"],
+            "actual": row["actual"],
+            "actual_bbox": frame_box(row, "actual_"),
+            "predicted_bbox": frame_box(row, "predicted_"),
+            "predicted_label": row["predicted_label"],
+            **{column: row[column] for column in RESULT_SCORE_COLUMNS},
+        }
+        for row in df.to_dict("records")
+    ]
+
+def convert(input_path: str, output_path: str):
+    """Convert between the JSON and columnar formats, detecting predictions vs processed results."""
+    if is_columnar_path(input_path):
+        df = load_frame(input_path)
+        items = processed_results_frame_to_json(df) if "actual" in df.columns else predictions_frame_to_json(df)
+        with open(output_path, "w") as f:
+            json.dump(items, f, indent=4)
+        return
+    with open(input_path, "r") as f:
+        first_char = f.read(1)
+    if first_char == "[":
+        with open(input_path, "r") as f:
+            items = json.load(f)
+        is_processed = bool(items) and "actual" in items[0]
+        df = processed_results_to_frame(items) if is_processed else predictions_to_frame(items)
+    else:
+        df = load_predictions_frame(input_path)
+    save_frame(df, output_path)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="JSON / JSON Lines or .parquet / .npz file")
+    parser.add_argument("output", help="Output file, its extension selects the format")
+    args = parser.parse_args()
+    if is_columnar_path(args.input) == is_columnar_path(args.output):
+        parser.error("Convert from JSON to a columnar format or back")
+    convert(args.input, args.output)
+    print(f"Converted {args.input} to {args.output} ({os.path.getsize(args.output)} bytes)")
@@ -1,30 +1,153 @@
-import requests
-import io
 import os
+import sys
 import json
+import time
 import tqdm
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from models import APIResponse
 
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "batch-process"))
+from prediction_client import PredictionClient
+
+DEFAULT_CONCURRENCY = 8
+
+_client = None
+
+def get_prediction_client() -> PredictionClient:
+    """Shared client, so every image reuses the same pooled connections."""
+    global _client
+    if _client is None:
+        _client = PredictionClient()
+    return _client
+
 def send_image_for_prediction(image_path) -> list[APIResponse]:
     with open(image_path, "rb") as f:
         image_data = f.read()
-        files = {
-            'image': ('image.jpg', io.BytesIO(image_data), 'image/jpeg')
-        }
-        prediction_url = os.environ.get('PREDICTION_URL', 'http://localhost:3000/predict')
-        response = requests.post(
-            prediction_url,
-            files=files,
-            timeout=30
+    results = get_prediction_client().predict(image_data)
+    return [APIResponse.from_json(r, image=image_path) for r in results]
+
+def predict_image_record(image_path: str) -> dict:
+    """One JSON Lines record: the predictions of an image and the latency of its request."""
+    with open(image_path, "rb") as f:
+        image_data = f.read()
+    results, latency = get_prediction_client().predict_timed(image_data)
+    predictions = [APIResponse.from_json(r, image=image_path).to_dict() for r in results]
+    return {"image": image_path, "latency": latency, "predictions": predictions}
+
+def load_harvested_images(output_path: str) -> set[str]:
+    """
+    Images already present in a predictions file, so a restarted harvest can skip them.
+    A record cut short by a crash is dropped from the file, and a file in the old JSON
+    array format is rewritten as JSON Lines.
+    """
+    if not os.path.exists(output_path):
+        return set()
+    with open(output_path, "r") as f:
+        content = f.read()
+
+    if content.lstrip().startswith("["):
+        records: dict[str, list] = {}
+        for item in json.loads(content):
+            records.setdefault(item.get("image", ""), []).append(item)
+        # Replaced atomically, so an interrupted conversion leaves the old file intact
+        tmp_path = f"{output_path}.tmp"
+        with open(tmp_path, "w") as f:
+            for image, predictions in records.items():
+                f.write(json.dumps({"image": image, "predictions": predictions}) + "\n")
+        os.replace(tmp_path, output_path)
+        return set(records)
+
+    images = set()
+    valid_length = 0
+    for line in content.splitlines(keepends=True):
+        # Records are written with their newline in one call, so a line without it was cut short
+        if not line.endswith("\n"):
+            break
+        try:
+            images.add(json.loads(line)["image"])
+        except (json.JSONDecodeError, KeyError):
+            break
+        valid_length += len(line)
+    if valid_length < len(content):
+        with open(output_path, "r+") as f:
+            f.truncate(valid_length)
+    return images
+
+def harvest_predictions(image_paths, output_path, concurrency: int = DEFAULT_CONCURRENCY) -> dict:
+    """
+    Send images to the prediction service with at most `concurrency` requests in flight,
+    appending one JSON Lines record per image to `output_path` as soon as it completes.
+    Images already in the file are skipped, so an interrupted harvest resumes where it stopped.
+    Failed images are not written and are retried by the next run.
+
+    Returns:
+        Summary with the number of processed, skipped and failed images, throughput
+        and request latency percentiles
+    """
+    image_paths = list(dict.fromkeys(image_paths))
+    done = load_harvested_images(output_path)
+    pending = [path for path in image_paths if path not in done]
+    skipped = len(image_paths) - len(pending)
+    if skipped:
+        print(f"Skipping {skipped} images already in {output_path}")
+
+    client = get_prediction_client()
+    failed = []
+    processed = 0
+    start_time = time.perf_counter()
+    remaining = iter(pending)
+    with open(output_path, "a") as output, \
+            ThreadPoolExecutor(max_workers=concurrency) as executor, \
+            tqdm.tqdm(total=len(pending)) as progress:
+        in_flight = {}
+        for image_path in remaining:
+            in_flight[executor.submit(predict_image_record, image_path)] = image_path
+            if len(in_flight) >= concurrency:
+                break
+        while in_flight:
+            completed, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in completed:
+                image_path = in_flight.pop(future)
+                try:
+                    output.write(json.dumps(future.result()) + "\n")
+                    processed += 1
+                except Exception as e:
+                    print(f"Prediction failed for {image_path}: {e}")
+                    failed.append(image_path)
+                next_path = next(remaining, None)
+                if next_path is not None:
+                    in_flight[executor.submit(predict_image_record, next_path)] = next_path
+            output.flush()
+            progress.update(len(completed))
+            stats = client.stats()
+            if stats["requests"]:
+                progress.set_postfix(
+                    img_s=f"{processed / (time.perf_counter() - start_time):.1f}",
+                    p50=f"{stats['p50'] * 1000:.0f}ms",
+                    p95=f"{stats['p95'] * 1000:.0f}ms",
+                    p99=f"{stats['p99'] * 1000:.0f}ms",
+                )
+
+    elapsed = time.perf_counter() - start_time
+    summary = {
+        "processed": processed,
+        "skipped": skipped,
+        "failed": len(failed),
+        "images_per_second": processed / elapsed if elapsed > 0 else 0.0,
+        "latency": client.stats(),
+    }
+    print(f"Harvest summary: {summary}")
+    if failed:
+        print(f"{len(failed)} images failed and will be retried on the next run")
+    return summary
+
+def save_predictions_to_file(image_paths, output_path, concurrency: int = DEFAULT_CONCURRENCY):
+    """
+    Harvest predictions for all images, raising if some of them failed so an incomplete
+    file is not analysed as if the failed images had no detections. Calling it again resumes.
+    """
+    summary = harvest_predictions(image_paths, output_path, concurrency)
+    if summary["failed"]:
+        raise RuntimeError(
+            f"Predictions failed for {summary['failed']} images, run again to retry them before analysing {output_path}"
         )
-        if response.status_code != 200:
-            raise Exception(f"Error: {response.status_code}, {response.text}")
-        return [APIResponse.from_json(r, image=image_path) for r in response.json()]
-
-def save_predictions_to_file(image_paths, output_path):
-    all_results = []
-    for image_path in tqdm.tqdm(image_paths):
-        response = send_image_for_prediction(image_path)
-        all_results.extend([r.to_dict() for r in response])
-    with open(output_path, "w") as f:
-        json.dump(all_results, f, indent=4)
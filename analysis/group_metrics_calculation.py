@@ -1,4 +1,4 @@
-from sklearn.metrics import precision_score, recall_score, f1_score, average_precision_score
+from sklearn.metrics import precision_score, recall_score, f1_score
 import pandas as pd
 import numpy as np
 
@@ -22,46 +22,145 @@ def calculate_basic_classification_metrics(df_group):
         'f1_damaged': float(f1[1]) if len(f1) > 1 else 0.0
     }
 
+IOU_THRESHOLDS = np.arange(0.5, 1.0, 0.05)
+CLASSES = ['healthy', 'damaged']
+
+def class_scores(df, cls):
+    """Detection score of every row for a class, before the IoU threshold is applied."""
+    if cls == 'healthy':
+        return (df['confidence'] * df['score'] * (df['score'] >= 0.5).astype(float)).to_numpy(dtype=float)
+    return (df['confidence'] * (1 - df['score']) * (df['score'] <= 0.5).astype(float)).to_numpy(dtype=float)
+
+def average_precision_by_group(group_codes, y_true, scores, ious, n_groups, iou_thresholds=IOU_THRESHOLDS):
+    """
+    Average precision of every group at every IoU threshold, as a (n_groups, n_thresholds) array.
+
+    Gives the same result as sklearn's average_precision_score(y_true, scores * (ious >= thr)) run on each
+    group and threshold, with AP 0 for groups without positives. Rows are sorted by (group, score) once:
+    raising the IoU threshold only moves rows into the zero score tie, so the cumulative TP/FP counts at
+    every threshold follow from one cumulative sum over a (thresholds x rows) mask. Scores must be >= 0.
+    """
+    order = np.lexsort((-scores, group_codes))
+    groups = group_codes[order]
+    scores = scores[order]
+    positive = y_true[order].astype(bool)
+
+    # Rows keeping a non-zero score at each threshold
+    kept = (ious[order][None, :] >= iou_thresholds[:, None]) & (scores > 0)[None, :]
+    tp = np.cumsum(kept & positive, axis=1)
+    fp = np.cumsum(kept & ~positive, axis=1)
+
+    # Last row of each group and of each run of tied scores: the only points where the PR curve moves
+    last = np.ones(len(scores), dtype=bool)
+    last[:-1] = (groups[1:] != groups[:-1]) | (scores[1:] != scores[:-1])
+    points = np.flatnonzero(last)
+    point_groups = groups[points]
+    first_point = np.ones(len(points), dtype=bool)
+    first_point[1:] = point_groups[1:] != point_groups[:-1]
+
+    # Counts are cumulative over all groups, so subtract what preceding groups accumulated
+    group_sizes = np.bincount(groups, minlength=n_groups)
+    group_starts = np.concatenate([[0], np.cumsum(group_sizes)[:-1]])
+    point_starts = group_starts[point_groups]
+    tp_before = np.where(point_starts > 0, tp[:, np.maximum(point_starts - 1, 0)], 0)
+    fp_before = np.where(point_starts > 0, fp[:, np.maximum(point_starts - 1, 0)], 0)
+    tp_points = tp[:, points] - tp_before
+    fp_points = fp[:, points] - fp_before
+
+    positives = np.bincount(groups, weights=positive, minlength=n_groups)
+    point_positives = positives[point_groups]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        recall = np.where(point_positives > 0, tp_points / point_positives, 0.0)
+        precision = np.where(tp_points + fp_points > 0, tp_points / (tp_points + fp_points), 0.0)
+    previous_recall = np.zeros_like(recall)
+    previous_recall[:, 1:] = recall[:, :-1]
+    previous_recall[:, first_point] = 0.0
+
+    ap = np.zeros((len(iou_thresholds), n_groups))
+    np.add.at(ap.T, point_groups, ((recall - previous_recall) * precision).T)
+
+    # Final point of each group: every row is predicted positive once the zero score tie is included
+    last_point = np.ones(len(points), dtype=bool)
+    last_point[:-1] = first_point[1:]
+    last_recall = np.zeros((len(iou_thresholds), n_groups))
+    last_recall[:, point_groups[last_point]] = recall[:, last_point]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ap += (1.0 - last_recall) * np.where(group_sizes > 0, positives / group_sizes, 0.0)
+    ap[:, positives == 0] = 0.0
+    return ap.T
+
+def map_metrics_from_aps(ap_healthy, ap_damaged):
+    """mAP_50 and mAP_50_95 from per-threshold APs of both classes (last axis is the IoU threshold)."""
+    mean_ap = (ap_healthy + ap_damaged) / 2
+    return mean_ap[..., 0], mean_ap.mean(axis=-1)
+
 def calculate_map_metrics(df_group):
     """Calculate mAP@0.5 and mAP@0.5:0.95 for a brightness group."""
-    ious = np.arange(0.5, 1.0, 0.05)
-    aps = []
-    
-    for iou_thr in ious:
-        # AP for healthy class
-        y_true_healthy = (df_group['actual'] == 'healthy').astype(int)
-        y_score_healthy = (df_group['confidence'] * df_group['score'] * 
-                          (df_group['iou'] >= iou_thr).astype(float) * 
-                          (df_group['score'] >= 0.5).astype(float))
-        
-        if y_true_healthy.sum() > 0:
-            ap_healthy = average_precision_score(y_true_healthy, y_score_healthy)
-        else:
-            ap_healthy = 0.0
-        
-        # AP for damaged class
-        y_true_damaged = (df_group['actual'] == 'damaged').astype(int)
-        y_score_damaged = (df_group['confidence'] * (1 - df_group['score']) * 
-                          (df_group['iou'] >= iou_thr).astype(float) * 
-                          (df_group['score'] <= 0.5).astype(float))
-        
-        if y_true_damaged.sum() > 0:
-            ap_damaged = average_precision_score(y_true_damaged, y_score_damaged)
-        else:
-            ap_damaged = 0.0
-        aps.append({'iou': iou_thr, 'AP_healthy': ap_healthy, 'AP_damaged': ap_damaged})
-    
-    aps_df = pd.DataFrame(aps)
-    aps_df['mAP'] = aps_df[['AP_healthy', 'AP_damaged']].mean(axis=1)
-    
-    map_50 = aps_df[aps_df['iou'] == 0.5]['mAP'].iloc[0] if len(aps_df) > 0 else 0.0
-    map_50_95 = aps_df['mAP'].mean()
+    codes = np.zeros(len(df_group), dtype=np.int64)
+    ious = df_group['iou'].to_numpy(dtype=float)
+    aps = [
+        average_precision_by_group(codes, (df_group['actual'] == cls).to_numpy(), class_scores(df_group, cls), ious, 1)[0]
+        for cls in CLASSES
+    ]
+    map_50, map_50_95 = map_metrics_from_aps(*aps)
     
     return {
         'mAP_50': float(map_50),
         'mAP_50_95': float(map_50_95)
     }
 
+def calculate_metrics_for_groups(df, group_column='group', groups_data=None, analysis_property='brightness'):
+    """
+    Metrics of every group of a table holding the processed predictions of all groups, in one pass.
+
+    Args:
+        df: Processed predictions of all groups, with the group name in `group_column`
+        groups_data: Optional {group_name: group_data} used to add the property statistics of
+            absolute groups (those with a 'target_property')
+
+    Returns:
+        {group_name: metrics}, with the same keys as calculate_metrics_for_group(_relative)
+    """
+    group_codes, group_names = pd.factorize(df[group_column], sort=True)
+    n_groups = len(group_names)
+    actual = df['actual'].to_numpy()
+    predicted = df['predicted_label'].to_numpy()
+    ious = df['iou'].to_numpy(dtype=float)
+
+    metrics = {name: {} for name in group_names}
+    aps = []
+    for cls in CLASSES:
+        is_actual = actual == cls
+        is_predicted = predicted == cls
+        tp = np.bincount(group_codes, weights=is_actual & is_predicted, minlength=n_groups)
+        n_predicted = np.bincount(group_codes, weights=is_predicted, minlength=n_groups)
+        n_actual = np.bincount(group_codes, weights=is_actual, minlength=n_groups)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            precision = np.where(n_predicted > 0, tp / n_predicted, 0.0)
+            recall = np.where(n_actual > 0, tp / n_actual, 0.0)
+            f1 = np.where(n_predicted + n_actual > 0, 2 * tp / (n_predicted + n_actual), 0.0)
+        for i, name in enumerate(group_names):
+            metrics[name].update({
+                f'precision_{cls}': float(precision[i]),
+                f'recall_{cls}': float(recall[i]),
+                f'f1_{cls}': float(f1[i]),
+            })
+        aps.append(average_precision_by_group(group_codes, is_actual, class_scores(df, cls), ious, n_groups))
+
+    map_50, map_50_95 = map_metrics_from_aps(*aps)
+    sample_counts = np.bincount(group_codes, minlength=n_groups)
+    for i, name in enumerate(group_names):
+        group_metrics = {key: metrics[name][key] for key in (
+            'precision_healthy', 'precision_damaged', 'recall_healthy', 'recall_damaged', 'f1_healthy', 'f1_damaged'
+        )}
+        group_metrics.update({'mAP_50': float(map_50[i]), 'mAP_50_95': float(map_50_95[i])})
+        group_data = (groups_data or {}).get(name)
+        if group_data is not None and 'target_property' in group_data:
+            group_metrics.update(calculate_brightness_statistics(group_data, analysis_property))
+        group_metrics['sample_count'] = int(sample_counts[i])
+        metrics[name] = group_metrics
+    return metrics
+
 def calculate_brightness_statistics(group_data, analysis_property='brightness'):
     """Calculate brightness/property statistics for a group."""
     property_values = group_data['actual_property_values']
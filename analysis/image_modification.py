@@ -1,11 +1,15 @@
 import cv2
 import numpy as np
 from PIL import Image, ImageEnhance
+import io
 import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Optional
 from tqdm import tqdm
 
-def measure_image_properties(image_path: str) -> dict[str, float]:
-    image = cv2.imread(image_path)
+def measure_array_properties(image: np.ndarray) -> dict[str, float]:
+    """Measure an already decoded BGR image, as returned by cv2.imread."""
     gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
     hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
     
@@ -19,19 +23,33 @@ def measure_image_properties(image_path: str) -> dict[str, float]:
         'saturation': float(saturation),
     }
 
-def modify_image_property_absolute(
-    image_path: str,
+def measure_image_properties(image_path: str) -> dict[str, float]:
+    return measure_array_properties(cv2.imread(image_path))
+
+def measure_encoded_properties(data: bytes) -> dict[str, float]:
+    """Measure an encoded image held in memory, decoding it the same way cv2.imread would."""
+    return measure_array_properties(cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR))
+
+def encode_image(image: Image.Image, path: str) -> bytes:
+    """Encode an image exactly as image.save(path) would, but into memory."""
+    buffer = io.BytesIO()
+    image.save(buffer, format=Image.registered_extensions()[os.path.splitext(path)[1].lower()])
+    return buffer.getvalue()
+
+def decode_original(image_path: str) -> tuple[Image.Image, np.ndarray]:
+    """Decode an original once, as the PIL image that gets enhanced and the BGR array that gets measured."""
+    with open(image_path, "rb") as f:
+        data = f.read()
+    image = Image.open(io.BytesIO(data))
+    image.load()
+    return image, cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+def apply_property_absolute(
+    image: Image.Image,
+    current_props: dict[str, float],
     property: str,
     target_value: float
-) -> tuple[Image.Image, dict[str, float]]:
-    """
-    Modify image properties to reach target values.
-    Returns the modified image and actual achieved properties.
-    """
-    image = Image.open(image_path)
-    
-    current_props = measure_image_properties(image_path)
-    
+) -> Image.Image:
     if property == 'brightness':
         current_brightness = current_props['brightness']
         if current_brightness > 0:
@@ -53,72 +71,29 @@ def modify_image_property_absolute(
             enhancer = ImageEnhance.Contrast(image)
             image = enhancer.enhance(contrast_factor)
     
-    return image, current_props
-
-def create_property_groups(base_output_dir, orig_image_paths: list[str], property: str, property_levels: list[float]) -> dict:
-    base_dir = os.path.join(base_output_dir, f"{property}_analysis")
-    os.makedirs(base_dir, exist_ok=True)
-
-    property_groups = {}
-
-    for target_property in property_levels:
-        group_name = f"{property}_{target_property:.2f}"
-        group_dir = os.path.join(base_dir, group_name)
-        os.makedirs(group_dir, exist_ok=True)
-
-        property_groups[group_name] = {
-            'target_property': target_property,
-            'images': [],
-            'actual_property_values': []
-        }
-
-        print(f"Creating {property} group {group_name} (target: {target_property})")
-
-        for original_path in tqdm(orig_image_paths, desc=f"Processing {group_name}"):
-            modified_image, original_props = modify_image_property_absolute(
-                original_path, property, target_property
-            )
-            
-            filename = os.path.basename(original_path)
-            modified_path = os.path.join(group_dir, filename)
-            modified_image.save(modified_path)
-            
-            actual_props = measure_image_properties(modified_path)
-            actual_value = actual_props[property]
-
-            property_groups[group_name]['images'].append({
-                'original_path': original_path,
-                'modified_path': modified_path,
-                'original_properties': original_props,
-                'actual_properties': actual_props,
-                'actual_value': actual_value
-            })
-            property_groups[group_name]['actual_property_values'].append(actual_value)
+    return image
 
-    return property_groups
-
-def modify_image_property_relative(
+def modify_image_property_absolute(
     image_path: str,
-    property_name: str,
-    relative_change: float
+    property: str,
+    target_value: float
 ) -> tuple[Image.Image, dict[str, float]]:
     """
-    Modify image properties by a relative percentage change.
-    
-    Args:
-        image_path: Path to the image
-        property_name: Property to modify ('brightness', 'saturation', 'contrast', 'blur')
-        relative_change: Relative change as decimal (e.g., 0.2 = +20%, -0.1 = -10%)
-    
-    Returns:
-        Modified image and original properties
+    Modify image properties to reach target values.
+    Returns the modified image and actual achieved properties.
     """
-    image = Image.open(image_path)
-    
-    original_props = measure_image_properties(image_path)
-    
+    image, cv_image = decode_original(image_path)
+    current_props = measure_array_properties(cv_image)
+    return apply_property_absolute(image, current_props, property, target_value), current_props
+
+def apply_property_relative(
+    image: Image.Image,
+    cv_image: np.ndarray,
+    property_name: str,
+    relative_change: float
+) -> Image.Image:
     if relative_change == 0:
-        return image, original_props
+        return image
     
     enhancement_factor = 1.0 + relative_change
     
@@ -138,8 +113,6 @@ def modify_image_property_relative(
         # For blur, only allow positive changes (adding blur)
         # Negative values don't make sense as we can't reduce blur below the original level
         if relative_change > 0:
-            # Add blur using Gaussian filter
-            cv_image = cv2.imread(image_path)
             # Scale kernel size based on relative change (more change = more blur)
             kernel_size = max(1, int(15 * relative_change))
             if kernel_size % 2 == 0:
@@ -149,18 +122,139 @@ def modify_image_property_relative(
         elif relative_change < 0:
             print(f"Warning: Negative blur change ({relative_change}) ignored. Cannot reduce blur below original level.")
     
-    return image, original_props
+    return image
+
+def modify_image_property_relative(
+    image_path: str,
+    property_name: str,
+    relative_change: float
+) -> tuple[Image.Image, dict[str, float]]:
+    """
+    Modify image properties by a relative percentage change.
+    
+    Args:
+        image_path: Path to the image
+        property_name: Property to modify ('brightness', 'saturation', 'contrast', 'blur')
+        relative_change: Relative change as decimal (e.g., 0.2 = +20%, -0.1 = -10%)
+    
+    Returns:
+        Modified image and original properties
+    """
+    image, cv_image = decode_original(image_path)
+    original_props = measure_array_properties(cv_image)
+    return apply_property_relative(image, cv_image, property_name, relative_change), original_props
+
+def process_original(
+    original_path: str,
+    property: str,
+    levels: list[float],
+    group_dirs: list[str],
+    relative: bool
+) -> list[dict]:
+    """
+    Create every level of one original: decode it once, apply each level to the decoded image,
+    write the result and measure the encoded output in memory instead of reading it back.
+    Returns one image record per level, in the order of `levels`.
+    """
+    image, cv_image = decode_original(original_path)
+    original_props = measure_array_properties(cv_image)
+    filename = os.path.basename(original_path)
+
+    records = []
+    for level, group_dir in zip(levels, group_dirs):
+        if relative:
+            modified_image = apply_property_relative(image, cv_image, property, level)
+        else:
+            modified_image = apply_property_absolute(image, original_props, property, level)
+
+        modified_path = os.path.join(group_dir, filename)
+        data = encode_image(modified_image, modified_path)
+        with open(modified_path, "wb") as f:
+            f.write(data)
 
-def create_property_groups_relative(base_output_dir, orig_image_paths: list[str], property: str, property_levels: list[float]) -> dict:
+        actual_props = measure_encoded_properties(data)
+        records.append({
+            'original_path': original_path,
+            'modified_path': modified_path,
+            'original_properties': original_props,
+            'actual_properties': actual_props,
+            'actual_value': actual_props[property]
+        })
+    return records
+
+def generate_property_groups(
+    orig_image_paths: list[str],
+    property: str,
+    levels: list[float],
+    group_dirs: list[str],
+    relative: bool,
+    workers: Optional[int]
+) -> list[list[dict]]:
+    """
+    Run process_original for every original on a process pool.
+    Returns, for each original in input order, its records in the order of `levels`,
+    so the groups come out the same regardless of the number of workers.
+    """
+    task = partial(process_original, property=property, levels=levels, group_dirs=group_dirs, relative=relative)
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        return [task(path) for path in tqdm(orig_image_paths, desc=f"Processing {property}")]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(tqdm(
+            executor.map(task, orig_image_paths, chunksize=max(1, len(orig_image_paths) // (workers * 8))),
+            total=len(orig_image_paths),
+            desc=f"Processing {property}"
+        ))
+
+def collect_property_groups(property_groups: dict, group_names: list[str], records_per_image: list[list[dict]]):
+    for records in records_per_image:
+        for group_name, record in zip(group_names, records):
+            property_groups[group_name]['images'].append(record)
+            property_groups[group_name]['actual_property_values'].append(record['actual_value'])
+
+def create_property_groups(base_output_dir, orig_image_paths: list[str], property: str, property_levels: list[float], workers: Optional[int] = None) -> dict:
+    base_dir = os.path.join(base_output_dir, f"{property}_analysis")
+    os.makedirs(base_dir, exist_ok=True)
+
+    property_groups = {}
+    group_names = []
+    group_dirs = []
+
+    for target_property in property_levels:
+        group_name = f"{property}_{target_property:.2f}"
+        group_dir = os.path.join(base_dir, group_name)
+        os.makedirs(group_dir, exist_ok=True)
+        group_names.append(group_name)
+        group_dirs.append(group_dir)
+
+        property_groups[group_name] = {
+            'target_property': target_property,
+            'images': [],
+            'actual_property_values': []
+        }
+
+        print(f"Creating {property} group {group_name} (target: {target_property})")
+
+    records_per_image = generate_property_groups(
+        orig_image_paths, property, list(property_levels), group_dirs, relative=False, workers=workers
+    )
+    collect_property_groups(property_groups, group_names, records_per_image)
+    return property_groups
+
+def create_property_groups_relative(base_output_dir, orig_image_paths: list[str], property: str, property_levels: list[float], workers: Optional[int] = None) -> dict:
     base_dir = os.path.join(base_output_dir, f"{property}_relative_analysis")
     os.makedirs(base_dir, exist_ok=True)
 
     property_groups = {}
+    group_names = []
+    group_dirs = []
 
     for relative_change in property_levels:
         group_name = f"{property}_rel_{relative_change:+.2f}"
         group_dir = os.path.join(base_dir, group_name)
         os.makedirs(group_dir, exist_ok=True)
+        group_names.append(group_name)
+        group_dirs.append(group_dir)
 
         property_groups[group_name] = {
             'relative_change': relative_change,
@@ -170,28 +264,8 @@ def create_property_groups_relative(base_output_dir, orig_image_paths: list[str]
 
         print(f"Creating {property} relative group {group_name} (change: {relative_change:+.2f})")
 
-        for original_path in tqdm(orig_image_paths, desc=f"Processing {group_name}"):
-            
-            modified_image, original_props = modify_image_property_relative(
-                original_path, property, relative_change
-            )
-
-            
-            filename = os.path.basename(original_path)
-            modified_path = os.path.join(group_dir, filename)
-            modified_image.save(modified_path)
-
-            
-            actual_props = measure_image_properties(modified_path)
-            actual_value = actual_props[property]
-
-            property_groups[group_name]['images'].append({
-                'original_path': original_path,
-                'modified_path': modified_path,
-                'original_properties': original_props,
-                'actual_properties': actual_props,
-                'actual_value': actual_value
-            })
-            property_groups[group_name]['actual_property_values'].append(actual_value)
-
-    return property_groups
\ No newline at end of file
+    records_per_image = generate_property_groups(
+        orig_image_paths, property, list(property_levels), group_dirs, relative=True, workers=workers
+    )
+    collect_property_groups(property_groups, group_names, records_per_image)
+    return property_groups
@@ -1,6 +1,10 @@
-from typing import Optional
+from typing import Optional, Iterator
+import numpy as np
+import pandas as pd
 
 class BBox:
+    __slots__ = ("x1", "y1", "x2", "y2")
+
     def __init__(self, x1: int, y1: int, x2: int, y2: int):
         self.x1 = x1
         self.y1 = y1
@@ -19,6 +23,8 @@ class BBox:
         }
 
 class APIResponse:
+    __slots__ = ("image", "bbox", "confidence", "cls_score", "damaged_score", "healthy_score")
+
     def __init__(
         self,
         image: str,
@@ -69,6 +75,8 @@ class APIResponse:
         }
 
 class ObjectPrediction:
+    __slots__ = ("image", "actual_bbox", "predicted_bbox", "predicted_label", "actual", "score", "iou", "confidence")
+
     def __init__(
         self,
         image: str,
@@ -138,4 +146,127 @@ class ObjectPrediction:
             score=data.get('score', 0.0),
             iou=data.get('iou', 0.0),
             confidence=data.get('confidence', 0.0)
-        )
\ No newline at end of file
+        )
+
+class PredictionBatch:
+    """
+    Struct-of-arrays alternative to a list of APIResponse.
+
+    Boxes and scores live in one (N, 8) float64 matrix: `boxes` is its (N, 4) column slice and
+    each score is a column view, so no per-prediction objects are kept and to_dataframe() wraps
+    the matrix without copying it. Images are stored dictionary encoded as codes into `images`.
+    """
+    BOX_COLUMNS = ["x1", "y1", "x2", "y2"]
+    SCORE_COLUMNS = ["confidence", "cls_score", "damaged_score", "healthy_score"]
+    COLUMNS = BOX_COLUMNS + SCORE_COLUMNS
+
+    def __init__(self, values: np.ndarray, image_codes: np.ndarray, images: np.ndarray):
+        self.values = values
+        self.image_codes = image_codes
+        self.images = images
+
+    @property
+    def boxes(self) -> np.ndarray:
+        return self.values[:, :4]
+
+    @property
+    def confidence(self) -> np.ndarray:
+        return self.values[:, 4]
+
+    @property
+    def cls_score(self) -> np.ndarray:
+        return self.values[:, 5]
+
+    @property
+    def damaged_score(self) -> np.ndarray:
+        return self.values[:, 6]
+
+    @property
+    def healthy_score(self) -> np.ndarray:
+        return self.values[:, 7]
+
+    @property
+    def image(self) -> np.ndarray:
+        return self.images[self.image_codes]
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def __getitem__(self, index: int) -> APIResponse:
+        x1, y1, x2, y2, confidence, cls_score, damaged_score, healthy_score = self.values[index].tolist()
+        return APIResponse(
+            image=str(self.images[self.image_codes[index]]),
+            # Boxes are integer pixels in the JSON files, so they come back as ints like they were loaded
+            bbox=BBox(*(int(v) if v.is_integer() else v for v in (x1, y1, x2, y2))),
+            confidence=confidence,
+            cls_score=cls_score,
+            damaged_score=damaged_score,
+            healthy_score=healthy_score
+        )
+
+    def __iter__(self) -> Iterator[APIResponse]:
+        return (self[i] for i in range(len(self)))
+
+    @classmethod
+    def from_dicts(cls, items: list[dict]) -> 'PredictionBatch':
+        """Build a batch from prediction dicts in the APIResponse.to_dict format."""
+        values = np.empty((len(items), len(cls.COLUMNS)), dtype=np.float64)
+        for i, item in enumerate(items):
+            box = item['box']
+            values[i] = (
+                box['x1'], box['y1'], box['x2'], box['y2'],
+                item.get('confidence', 0.0), item.get('cls_score', 0.0),
+                item.get('damaged_score', 0.0), item.get('healthy_score', 0.0)
+            )
+        image_codes, images = pd.factorize(pd.Series([item.get('image', '') for item in items], dtype=object))
+        return cls(values, image_codes, np.asarray(images, dtype=object))
+
+    @classmethod
+    def from_responses(cls, responses: list[APIResponse]) -> 'PredictionBatch':
+        return cls.from_dicts([r.to_dict() for r in responses])
+
+    @classmethod
+    def from_dataframe(cls, df: pd.DataFrame) -> 'PredictionBatch':
+        """Build a batch from a flat predictions table (as produced by to_dataframe or columnar_storage)."""
+        image_codes, images = pd.factorize(df['image'])
+        values = np.ascontiguousarray(df[cls.COLUMNS].to_numpy(dtype=np.float64))
+        return cls(values, image_codes, np.asarray(images, dtype=object))
+
+    def to_dicts(self) -> list[dict]:
+        """Prediction dicts in the APIResponse.to_dict format."""
+        return [response.to_dict() for response in self]
+
+    def to_dict(self) -> dict:
+        """Columnar dict of the batch, the inverse of from_dict."""
+        return {
+            "image": self.image.tolist(),
+            **{column: self.values[:, i].tolist() for i, column in enumerate(self.COLUMNS)}
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'PredictionBatch':
+        values = np.column_stack([np.asarray(data[column], dtype=np.float64) for column in cls.COLUMNS]) \
+            if len(data['image']) else np.empty((0, len(cls.COLUMNS)))
+        image_codes, images = pd.factorize(pd.Series(data['image'], dtype=object))
+        return cls(np.ascontiguousarray(values), image_codes, np.asarray(images, dtype=object))
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """DataFrame whose box and score columns are views of the batch's matrix (no copy)."""
+        df = pd.DataFrame(self.values, columns=self.COLUMNS, copy=False)
+        df.insert(0, "image", pd.Categorical.from_codes(self.image_codes, categories=self.images))
+        return df
+
+    def group_by_image(self) -> dict[str, 'PredictionBatch']:
+        """
+        Split the batch per image, keeping the order of first appearance. The batch is reordered
+        once and every group is a view of it that shares the image names, so splitting allocates
+        no per-image arrays.
+        """
+        order = np.argsort(self.image_codes, kind="stable")
+        values = self.values[order]
+        image_codes = self.image_codes[order]
+        bounds = np.searchsorted(image_codes, np.arange(len(self.images) + 1))
+        return {
+            str(image): PredictionBatch(values[start:end], image_codes[start:end], self.images)
+            for image, start, end in zip(self.images, bounds[:-1], bounds[1:])
+        }
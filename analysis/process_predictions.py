@@ -1,10 +1,13 @@
 import json, os
-import cv2
+import numpy as np
 import tqdm
-from models import BBox, APIResponse, ObjectPrediction
+from PIL import Image
+from models import BBox, APIResponse, ObjectPrediction, PredictionBatch
+from columnar_storage import is_columnar_path, load_frame, processed_results_to_frame, save_frame
 
 IOU_THRESHOLD = 0.5
 CONFIDENCE_THRESHOLD = 0.4
+EXIF_ORIENTATION_TAG = 0x0112
 
 def compute_iou(boxA: BBox, boxB: BBox) -> float:
     xA = max(boxA.x1, boxB.x1)
@@ -19,6 +22,37 @@ def compute_iou(boxA: BBox, boxB: BBox) -> float:
     iou = interArea / float(boxAArea + boxBArea - interArea)
     return iou
 
+def boxes_to_array(bboxes: list[BBox]) -> np.ndarray:
+    return np.array([(b.x1, b.y1, b.x2, b.y2) for b in bboxes]).reshape(-1, 4)
+
+def compute_iou_matrix(boxesA: np.ndarray, boxesB: np.ndarray) -> np.ndarray:
+    """
+    Pairwise IoU of two Nx4 / Mx4 box arrays as an NxM float64 matrix.
+    Performs the same operations in the same order as compute_iou, so every entry is bit-identical to it.
+    """
+    xA = np.maximum(boxesA[:, None, 0], boxesB[None, :, 0])
+    yA = np.maximum(boxesA[:, None, 1], boxesB[None, :, 1])
+    xB = np.minimum(boxesA[:, None, 2], boxesB[None, :, 2])
+    yB = np.minimum(boxesA[:, None, 3], boxesB[None, :, 3])
+
+    interArea = np.maximum(0, xB - xA) * np.maximum(0, yB - yA)
+    boxAArea = (boxesA[:, 2] - boxesA[:, 0]) * (boxesA[:, 3] - boxesA[:, 1])
+    boxBArea = (boxesB[:, 2] - boxesB[:, 0]) * (boxesB[:, 3] - boxesB[:, 1])
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return interArea / (boxAArea[:, None] + boxBArea[None, :] - interArea).astype(np.float64)
+
+def read_image_shape(image_path: str) -> tuple[int, int]:
+    """
+    (height, width) of an image as cv2.imread would load it (EXIF orientation applied),
+    read from the file headers without decoding the pixels.
+    """
+    with Image.open(image_path) as image:
+        width, height = image.size
+        if image.getexif().get(EXIF_ORIENTATION_TAG, 1) in (5, 6, 7, 8):
+            width, height = height, width
+    return height, width
+
 def load_gt_bboxes(label_path: str, image_shape: tuple, class_names=["damaged", "healthy"]) -> list[tuple[str, BBox]]:
     gt_bboxes = []
     with open(label_path, "r") as f:
@@ -39,11 +73,21 @@ def load_gt_bboxes(label_path: str, image_shape: tuple, class_names=["damaged",
             ))
     return gt_bboxes
 
-def process_predictions_of_image(image_path: str, predictions: list[APIResponse], gt_bboxes: list[tuple[str, BBox]]) -> list[ObjectPrediction]:
-    predictions = sorted(predictions, key=lambda p: p.confidence, reverse=True)
-    gt_bboxes_predicted = [False for _ in gt_bboxes]
+def process_predictions_of_image(image_path: str, predictions: PredictionBatch | list[APIResponse], gt_bboxes: list[tuple[str, BBox]]) -> list[ObjectPrediction]:
+    if not isinstance(predictions, PredictionBatch):
+        predictions = PredictionBatch.from_responses(predictions)
+    # Stable, so equal confidences keep their order like sorted(..., reverse=True)
+    order = np.argsort(-predictions.confidence, kind="stable")
+    gt_bboxes_predicted = np.zeros(len(gt_bboxes), dtype=bool)
+    iou_matrix = compute_iou_matrix(
+        predictions.boxes[order],
+        boxes_to_array([gt[1] for gt in gt_bboxes])
+    )
+    # Pairs that could ever be matched; NaN IoUs of degenerate boxes never are
+    matchable = iou_matrix >= IOU_THRESHOLD
     results: list[ObjectPrediction] = []
-    for p in predictions:
+    for index, ious, candidates in zip(order, iou_matrix, matchable):
+        p = predictions[index]
         # Find the closest ground truth bbox for label
         best_iou = 0
         actual_label = "background"
@@ -56,15 +100,12 @@ def process_predictions_of_image(image_path: str, predictions: list[APIResponse]
             predicted_label = "damaged"
 
         gt_idx = None
-        for i, gt in enumerate(gt_bboxes):
-            if gt_bboxes_predicted[i]: # dont repeat a gt_bbox
-                continue
-            iou = compute_iou(p.bbox, gt[1])
-            if iou >= IOU_THRESHOLD and iou > best_iou:
-                best_iou = iou
-                actual_label = gt[0]
-                gt_idx = i
-        if gt_idx is not None:
+        candidates = candidates & ~gt_bboxes_predicted # dont repeat a gt_bbox
+        if candidates.any():
+            # argmax picks the first of equal IoUs, like the strict > of a sequential scan
+            gt_idx = int(np.argmax(np.where(candidates, ious, -np.inf)))
+            best_iou = float(ious[gt_idx])
+            actual_label = gt_bboxes[gt_idx][0]
             gt_bboxes_predicted[gt_idx] = True
 
         results.append(ObjectPrediction(
@@ -92,35 +133,54 @@ def process_predictions_of_image(image_path: str, predictions: list[APIResponse]
             ))
     return results
 
-def load_api_predictions_from_file(predictions_file: str) -> dict[str, list[APIResponse]]:
+def iter_api_prediction_items(predictions_file: str):
+    """
+    Yield the prediction dicts of a predictions file, either a JSON array of predictions
+    or JSON Lines with one {"image", "predictions"} record per image, as written by get_predictions.
+    """
     with open(predictions_file, "r") as f:
-        data = json.load(f)
-        predictions_dict: dict[str, list[APIResponse]] = {}
-        for item in data:
-            image = item.get("image", "")
-            if image not in predictions_dict:
-                predictions_dict[image] = []
-            predictions_dict[image].append(APIResponse.from_json(item))
-        return predictions_dict
+        content = f.read()
+    if content.lstrip().startswith("["):
+        yield from json.loads(content)
+        return
+    for line in content.splitlines():
+        if line.strip():
+            yield from json.loads(line)["predictions"]
+
+def load_api_prediction_batches(predictions_file: str) -> dict[str, PredictionBatch]:
+    """
+    Predictions of a JSON, JSON Lines or columnar file grouped per image as PredictionBatch,
+    so no per-prediction objects are kept while processing a sweep.
+    """
+    if is_columnar_path(predictions_file):
+        batch = PredictionBatch.from_dataframe(load_frame(predictions_file))
+    else:
+        batch = PredictionBatch.from_dicts(list(iter_api_prediction_items(predictions_file)))
+    return batch.group_by_image()
+
+def load_api_predictions_from_file(predictions_file: str) -> dict[str, list[APIResponse]]:
+    return {image: list(batch) for image, batch in load_api_prediction_batches(predictions_file).items()}
     
 def save_processed_results_to_file(results: list[ObjectPrediction], output_path: str):
+    """Save as JSON, or as a columnar table if `output_path` ends in .parquet or .npz."""
+    if is_columnar_path(output_path):
+        save_frame(processed_results_to_frame([r.to_dict() for r in results]), output_path)
+        return
     with open(output_path, "w") as f:
         json.dump([r.to_dict() for r in results], f, indent=4)
 
 def process_all_predictions(image_paths: list[str], predictions_file: str, labels_dir: str, output_path: str):
-    api_predictions = load_api_predictions_from_file(predictions_file)
+    api_predictions = load_api_prediction_batches(predictions_file)
     all_results: list[ObjectPrediction] = []
 
     for image_path in tqdm.tqdm(image_paths):
-        predictions = api_predictions.get(image_path, [])
+        predictions = api_predictions.get(image_path, PredictionBatch.from_dicts([]))
         file_name = os.path.basename(image_path).replace(".jpg", ".txt")
         label_path = os.path.join(labels_dir, file_name)
         if not os.path.exists(label_path):
             print(f"Label file not found for {image_path}, skipping.")
             continue
-        image = cv2.imread(image_path)
-        
-        gt_bboxes = load_gt_bboxes(label_path, image.shape[:2])
+        gt_bboxes = load_gt_bboxes(label_path, read_image_shape(image_path))
         results = process_predictions_of_image(image_path, predictions, gt_bboxes)
         all_results.extend(results)
     save_processed_results_to_file(all_results, output_path)
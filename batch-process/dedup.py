@@ -0,0 +1,41 @@
+"""
+Perceptual hashes for spotting repeated reports of the same sign.
+
+Citizens often photograph the same sign several times from the same spot. The
+batch processor hashes every image with a 64-bit difference hash (dHash), which
+stays within a few bits across re-encoding, resizing and small changes of
+framing, and asks the database for an already processed report nearby whose hash
+is within `max_distance` bits. Such reports are linked to the original's results
+instead of running inference again.
+"""
+
+from PIL import Image
+
+from derivatives import EXIF_ORIENTATION_TAG, ORIENTATION_TRANSPOSES
+from prediction_client import BufferReader
+
+HASH_SIZE = 8
+
+
+def perceptual_hash(image_data) -> int:
+    """
+    Difference hash of an image, as a signed 64-bit integer (the range of a Postgres BIGINT).
+
+    The image is put upright, reduced to a 9x8 grayscale thumbnail and every bit records
+    whether a pixel is brighter than its right neighbour.
+    """
+    with Image.open(BufferReader(image_data)) as img:
+        orientation = img.getexif().get(EXIF_ORIENTATION_TAG, 1)
+        # Only a thumbnail is needed, so JPEGs are decoded at the smallest DCT scale
+        img.draft('L', (HASH_SIZE * 8, HASH_SIZE * 8))
+        thumbnail = img.convert('L')
+    if orientation in ORIENTATION_TRANSPOSES:
+        thumbnail = thumbnail.transpose(ORIENTATION_TRANSPOSES[orientation])
+    pixels = list(thumbnail.resize((HASH_SIZE + 1, HASH_SIZE), Image.Resampling.LANCZOS).getdata())
+
+    value = 0
+    for row in range(HASH_SIZE):
+        offset = row * (HASH_SIZE + 1)
+        for column in range(HASH_SIZE):
+            value = (value << 1) | (pixels[offset + column] > pixels[offset + column + 1])
+    return value - (1 << 64) if value >= 1 << 63 else value
@@ -0,0 +1,111 @@
+"""
+Bounded-resolution derivatives of report images.
+
+Phone photos are far larger than what the pipeline looks at (detections are
+letterboxed to 640 and crops classified at 380x380), so inference runs on a
+copy whose long side is at most `max_side`, with the EXIF orientation applied.
+Boxes predicted on the derivative are mapped back to the pixel coordinates of
+the original, as stored in S3.
+"""
+
+import io
+from typing import Dict, Any, Tuple
+
+from PIL import Image
+
+from prediction_client import BufferReader
+
+EXIF_ORIENTATION_TAG = 0x0112
+# PIL transpose operation that puts an image with the given EXIF orientation upright
+ORIENTATION_TRANSPOSES = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
+
+class ImageDerivative:
+    """Encoded derivative plus what is needed to map its coordinates back to the original."""
+
+    def __init__(self, data, original_size: Tuple[int, int], orientation: int, size: Tuple[int, int]):
+        self.data = data
+        self.original_size = original_size
+        self.orientation = orientation
+        self.size = size
+
+    def to_original_point(self, u: float, v: float) -> Tuple[float, float]:
+        """Map a point of the derivative to the stored (not rotated, full size) original."""
+        width, height = self.original_size
+        # Upright image, before scaling, has the original size with the axes swapped for orientations 5-8
+        upright_width, upright_height = (height, width) if self.orientation >= 5 else (width, height)
+        u = u * upright_width / self.size[0]
+        v = v * upright_height / self.size[1]
+        if self.orientation == 2:
+            return width - u, v
+        if self.orientation == 3:
+            return width - u, height - v
+        if self.orientation == 4:
+            return u, height - v
+        if self.orientation == 5:
+            return v, u
+        if self.orientation == 6:
+            return v, height - u
+        if self.orientation == 7:
+            return width - v, height - u
+        if self.orientation == 8:
+            return width - v, u
+        return u, v
+
+    def to_original_box(self, box: Dict[str, Any]) -> Dict[str, int]:
+        x_a, y_a = self.to_original_point(box['x1'], box['y1'])
+        x_b, y_b = self.to_original_point(box['x2'], box['y2'])
+        width, height = self.original_size
+        return {
+            'x1': max(0, int(min(x_a, x_b))),
+            'y1': max(0, int(min(y_a, y_b))),
+            'x2': min(width, int(max(x_a, x_b))),
+            'y2': min(height, int(max(y_a, y_b))),
+        }
+
+
+def create_derivative(image_data, max_side: int, quality: int) -> ImageDerivative:
+    """
+    Build the inference derivative of an image.
+
+    Images that are already upright and within `max_side` are passed through
+    unchanged. Otherwise JPEGs are decoded at a reduced DCT scale where possible,
+    rotated upright, resized with LANCZOS and re-encoded as JPEG with `quality`.
+
+    Args:
+        image_data: Encoded original image
+        max_side: Maximum length of the long side of the derivative
+        quality: JPEG quality of the re-encoded derivative
+
+    Returns:
+        The derivative and its mapping back to the original
+    """
+    with Image.open(BufferReader(image_data)) as img:
+        original_size = img.size
+        orientation = img.getexif().get(EXIF_ORIENTATION_TAG, 1)
+        if orientation not in ORIENTATION_TRANSPOSES:
+            orientation = 1
+        if orientation == 1 and max(original_size) <= max_side:
+            return ImageDerivative(image_data, original_size, orientation, original_size)
+
+        scale = min(1.0, max_side / max(original_size))
+        target_size = (max(1, round(original_size[0] * scale)), max(1, round(original_size[1] * scale)))
+        # Lets the JPEG decoder skip detail that the resize would throw away anyway
+        img.draft('RGB', target_size)
+        derivative = img.convert('RGB')
+        if derivative.size != target_size:
+            derivative = derivative.resize(target_size, Image.Resampling.LANCZOS)
+        if orientation != 1:
+            derivative = derivative.transpose(ORIENTATION_TRANSPOSES[orientation])
+
+    output = io.BytesIO()
+    derivative.save(output, format='JPEG', quality=quality)
+    return ImageDerivative(output.getbuffer(), original_size, orientation, derivative.size)
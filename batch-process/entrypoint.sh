@@ -1,6 +1,9 @@
 #!/bin/bash
-bentoml serve . --host 0.0.0.0 --port 3000 &
-until curl -sf http://localhost:3000/readyz > /dev/null; do
-    sleep 1
-done
-python main.py
\ No newline at end of file
+# The embedded backend runs the models inside main.py, so the pipeline server is only needed over HTTP
+if [ "${INFERENCE_BACKEND:-http}" = "http" ]; then
+    bentoml serve . --host 0.0.0.0 --port 3000 &
+    until curl -sf http://localhost:3000/readyz > /dev/null; do
+        sleep 1
+    done
+fi
+python main.py
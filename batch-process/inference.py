@@ -0,0 +1,192 @@
+"""
+Inference backends used by the batch processor.
+
+The HTTP backend posts each image to the BentoML pipeline service. The embedded
+backend loads the same ONNX models in-process and batches images from concurrently
+processed messages into single detector and classifier runs, avoiding the HTTP,
+multipart and JSON round trip when the models are available in the container.
+"""
+
+import os
+import sys
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Dict, Any, List
+
+from prediction_client import BufferReader, PredictionClient
+
+logger = logging.getLogger(__name__)
+
+# Bento containers ship the service sources in ./src, the repository keeps them in pipeline-server
+PIPELINE_SRC_DIRS = [
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src'),
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'pipeline-server', 'pipeline_service'),
+]
+
+
+class HttpInferenceBackend:
+    """Sends each image to the pipeline service over HTTP."""
+
+    def __init__(self):
+        self.client = PredictionClient()
+        logger.info(f"Sending prediction requests to: {self.client.prediction_url}")
+
+    def predict(self, image_data: bytes) -> List[Dict[str, Any]]:
+        """
+        Run the pipeline on one image.
+
+        Args:
+            image_data: Raw image data
+
+        Returns:
+            Detected objects as returned by the pipeline service
+        """
+        return self.client.predict(image_data)
+
+
+class EmbeddedInferenceBackend:
+    """
+    Runs the detection and classification models in-process.
+
+    Images are decoded on the calling worker thread and queued; a single dispatcher
+    thread groups up to `max_batch_size` queued images (waiting at most
+    `max_latency_ms` for the batch to fill) and runs them through both models together.
+    """
+
+    def __init__(self):
+        self.max_batch_size = int(os.environ.get('INFERENCE_MAX_BATCH_SIZE', 8))
+        self.max_latency = float(os.environ.get('INFERENCE_MAX_LATENCY_MS', 50)) / 1000
+        self._load_pipeline()
+        self.requests = queue.Queue()
+        self.dispatcher = threading.Thread(target=self._dispatch_loop, daemon=True)
+        self.dispatcher.start()
+
+    def _load_pipeline(self):
+        src_dir = os.environ.get('PIPELINE_SRC_DIR') or next(
+            (path for path in PIPELINE_SRC_DIRS if os.path.isdir(path)), PIPELINE_SRC_DIRS[0]
+        )
+        if src_dir not in sys.path:
+            sys.path.append(src_dir)
+
+        import bentoml
+        import numpy as np
+        from classification_utils import preprocess_crops
+        from detection_utils import INPUT_SIZE, preprocess_into, postprocess
+        from session_utils import create_session
+
+        self.np = np
+        self.preprocess_crops = preprocess_crops
+        self.preprocess_into = preprocess_into
+        self.postprocess = postprocess
+
+        detection_model = bentoml.onnx.get(os.environ.get('DETECTION_MODEL', 'detector:latest'))
+        classification_model = bentoml.onnx.get(os.environ.get('CLASSIFICATION_MODEL', 'classifier:latest'))
+        # Only the dispatcher thread runs the sessions, so each of them may use every core
+        self.detector = create_session(detection_model, "DETECTION")
+        self.classifier = create_session(classification_model, "CLASSIFICATION")
+        self.detector_input = np.empty((self.max_batch_size, 3, INPUT_SIZE, INPUT_SIZE), dtype=np.float32)
+        logger.info(f"Loaded embedded pipeline with {detection_model.tag} and {classification_model.tag}")
+
+    def _run_session(self, session, inputs):
+        """Run a session over a batch, chunking (and zero padding) it if the model has a static batch size."""
+        batch_dim = session.get_inputs()[0].shape[0]
+        input_name = session.get_inputs()[0].name
+        if not isinstance(batch_dim, int) or batch_dim == len(inputs):
+            return session.run(None, {input_name: inputs})[0]
+        outputs = []
+        for i in range(0, len(inputs), batch_dim):
+            chunk = inputs[i:i + batch_dim]
+            if len(chunk) < batch_dim:
+                padding = self.np.zeros((batch_dim - len(chunk), *chunk.shape[1:]), dtype=chunk.dtype)
+                chunk = self.np.concatenate([chunk, padding], axis=0)
+            outputs.append(session.run(None, {input_name: chunk})[0][:len(inputs) - i])
+        return self.np.concatenate(outputs, axis=0)
+
+    def predict(self, image_data: bytes) -> List[Dict[str, Any]]:
+        """
+        Run the pipeline on one image, batched with the images of other in-flight messages.
+
+        Args:
+            image_data: Raw image data
+
+        Returns:
+            Detected objects in the same format as the pipeline service
+        """
+        from PIL import Image
+        with Image.open(BufferReader(image_data)) as img:
+            pixels = self.np.asarray(img.convert("RGB"))
+        future = Future()
+        self.requests.put((pixels, future))
+        return future.result()
+
+    def _dispatch_loop(self):
+        while True:
+            batch = [self.requests.get()]
+            deadline = time.monotonic() + self.max_latency
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.requests.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                results = self._run_batch([pixels for pixels, _ in batch])
+                for (_, future), objects in zip(batch, results):
+                    future.set_result(objects)
+            except Exception as e:
+                logger.error(f"Embedded inference failed for a batch of {len(batch)} images: {str(e)}")
+                for _, future in batch:
+                    future.set_exception(e)
+
+    def _run_batch(self, images: list) -> List[List[Dict[str, Any]]]:
+        """Detect objects on all images at once, then classify the crops of every image in one run."""
+        img_batch = self.detector_input[:len(images)]
+        letterbox_params = [self.preprocess_into(slot, pixels) for slot, pixels in zip(img_batch, images)]
+        outputs = self._run_session(self.detector, img_batch)
+
+        detections = []
+        crops = []
+        for pixels, output, params in zip(images, outputs, letterbox_params):
+            boxes, confidences = self.postprocess(output, *params)
+            boxes = boxes.astype(int).tolist()
+            detections.append(list(zip(boxes, confidences.tolist())))
+            crops.extend(pixels[y1:y2, x1:x2] for x1, y1, x2, y2 in boxes)
+
+        scores = self._run_session(self.classifier, self.preprocess_crops(crops))[:, 0].tolist() if crops else []
+
+        results = []
+        score_index = 0
+        for image_detections in detections:
+            objects = []
+            for (x1, y1, x2, y2), confidence in image_detections:
+                score = scores[score_index]
+                score_index += 1
+                objects.append({
+                    'box': {'x1': x1, 'y1': y1, 'x2': x2, 'y2': y2},
+                    'confidence': float(confidence),
+                    'cls_score': float(score),
+                    'damaged_score': float(confidence * (1 - score)),
+                    'healthy_score': float(confidence * score)
+                })
+            results.append(objects)
+        return results
+
+
+INFERENCE_BACKENDS = {
+    'http': HttpInferenceBackend,
+    'embedded': EmbeddedInferenceBackend,
+}
+
+
+def create_inference_backend():
+    """Build the backend selected by the INFERENCE_BACKEND environment variable."""
+    backend = os.environ.get('INFERENCE_BACKEND', 'http').lower()
+    if backend not in INFERENCE_BACKENDS:
+        raise ValueError(f"Unknown INFERENCE_BACKEND '{backend}', expected one of {list(INFERENCE_BACKENDS)}")
+    logger.info(f"Using {backend} inference backend")
+    return INFERENCE_BACKENDS[backend]()
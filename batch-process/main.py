@@ -10,13 +10,16 @@ import os
 import time
 import logging
 import boto3
-import requests
-import io
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from datetime import datetime
 from typing import Dict, Any, Optional
 from botocore.exceptions import ClientError, NoCredentialsError
 from supabase import create_client, Client
 from dotenv import load_dotenv
+from inference import create_inference_backend
+from derivatives import create_derivative
+from dedup import perceptual_hash
 
 logging.basicConfig(
     level=logging.INFO,
@@ -26,6 +29,9 @@ logger = logging.getLogger(__name__)
 
 load_dotenv()
 
+SQS_MAX_MESSAGES = 10
+S3_CHUNK_SIZE = 256 * 1024
+
 class BatchProcessor:
     def __init__(self):
         self.sqs_client = None
@@ -33,9 +39,23 @@ class BatchProcessor:
         self.supabase_client = None
         self.queue_url = None
         self.bucket_name = None
+        self.workers = max(1, int(os.environ.get('BATCH_WORKERS', 4)))
+        self.s3_part_size = int(os.environ.get('S3_PART_SIZE', 8 * 1024 * 1024))
+        self.s3_max_concurrency = int(os.environ.get('S3_MAX_CONCURRENCY', 4))
+        self.derivative_max_side = int(os.environ.get('DERIVATIVE_MAX_SIDE', 2048))
+        self.derivative_quality = int(os.environ.get('DERIVATIVE_QUALITY', 90))
+        self.visibility_timeout = int(os.environ.get('VISIBILITY_TIMEOUT', 60))
+        self.dedup_radius_meters = float(os.environ.get('DEDUP_RADIUS_METERS', 25))
+        self.dedup_max_distance = int(os.environ.get('DEDUP_MAX_DISTANCE', 6))
+        # Messages received and not yet deleted or given up on, by MessageId, whose visibility is kept extended
+        self.leased_messages = {}
+        # Successfully processed messages waiting for the next batched delete, by MessageId
+        self.pending_deletes = {}
+        self.lease_lock = threading.Lock()
         
         self._initialize_aws_clients()
         self._initialize_supabase_client()
+        self.inference_backend = create_inference_backend()
     
     def _initialize_aws_clients(self):
         try:
@@ -113,10 +133,13 @@ class BatchProcessor:
                 WaitTimeSeconds=wait_time,
                 MessageAttributeNames=['All'],
                 AttributeNames=['All'],
-                VisibilityTimeout=30
+                VisibilityTimeout=self.visibility_timeout
             )
             
             messages = response.get('Messages', [])
+            with self.lease_lock:
+                for message in messages:
+                    self.leased_messages[message['MessageId']] = message['ReceiptHandle']
             logger.info(f"Received {len(messages)} messages from SQS queue")
             return messages
             
@@ -124,45 +147,139 @@ class BatchProcessor:
             logger.error(f"Failed to receive messages from SQS: {str(e)}")
             return []
     
-    def delete_message(self, receipt_handle: str) -> bool:
+    def delete_messages(self) -> int:
         """
-        Delete a processed message from the SQS queue.
+        Delete all successfully processed messages with batched delete calls.
         
-        Args:
-            receipt_handle: Receipt handle of the message to delete
-            
         Returns:
-            True if deletion was successful, False otherwise
+            Number of messages deleted
         """
-        try:
-            self.sqs_client.delete_message(
-                QueueUrl=self.queue_url,
-                ReceiptHandle=receipt_handle
-            )
-            logger.debug("Message deleted successfully from SQS queue")
-            return True
+        with self.lease_lock:
+            pending = list(self.pending_deletes.items())
+            self.pending_deletes.clear()
+        
+        deleted = 0
+        for start in range(0, len(pending), SQS_MAX_MESSAGES):
+            chunk = pending[start:start + SQS_MAX_MESSAGES]
+            try:
+                response = self.sqs_client.delete_message_batch(
+                    QueueUrl=self.queue_url,
+                    Entries=[
+                        {'Id': str(i), 'ReceiptHandle': receipt_handle}
+                        for i, (_, receipt_handle) in enumerate(chunk)
+                    ]
+                )
+                for failure in response.get('Failed', []):
+                    message_id = chunk[int(failure['Id'])][0]
+                    logger.error(f"Failed to delete message {message_id} from SQS: {failure.get('Message')}")
+                deleted += len(response.get('Successful', []))
+            except ClientError as e:
+                logger.error(f"Failed to delete messages from SQS: {str(e)}")
             
-        except ClientError as e:
-            logger.error(f"Failed to delete message from SQS: {str(e)}")
-            return False
+            # Messages that could not be deleted will be redelivered, so stop extending them either way
+            with self.lease_lock:
+                for message_id, _ in chunk:
+                    self.leased_messages.pop(message_id, None)
+        
+        if deleted:
+            logger.info(f"Deleted {deleted} messages from queue")
+        return deleted
     
-    def download_image_from_s3(self, s3_key: str) -> Optional[bytes]:
+    def extend_visibility(self):
         """
-        Download image from S3 using the provided URL.
+        Extend the visibility timeout of every message still being worked on,
+        so slow messages are not redelivered while in flight.
+        """
+        with self.lease_lock:
+            leased = list(self.leased_messages.items())
+        
+        for start in range(0, len(leased), SQS_MAX_MESSAGES):
+            chunk = leased[start:start + SQS_MAX_MESSAGES]
+            try:
+                response = self.sqs_client.change_message_visibility_batch(
+                    QueueUrl=self.queue_url,
+                    Entries=[
+                        {'Id': str(i), 'ReceiptHandle': receipt_handle, 'VisibilityTimeout': self.visibility_timeout}
+                        for i, (_, receipt_handle) in enumerate(chunk)
+                    ]
+                )
+                for failure in response.get('Failed', []):
+                    message_id = chunk[int(failure['Id'])][0]
+                    logger.warning(f"Failed to extend visibility of message {message_id}: {failure.get('Message')}")
+            except ClientError as e:
+                logger.error(f"Failed to extend message visibility: {str(e)}")
+    
+    def heartbeat(self, stop_event: threading.Event):
+        """
+        Background loop that flushes pending deletes and extends the visibility
+        of in-flight messages well before their timeout runs out.
+        """
+        interval = max(1, self.visibility_timeout / 3)
+        while not stop_event.wait(interval):
+            try:
+                self.delete_messages()
+                self.extend_visibility()
+            except Exception as e:
+                logger.error(f"Unexpected error in visibility heartbeat: {str(e)}")
+    
+    def _read_body_into(self, body, target: memoryview):
+        """Copy a streaming S3 body chunk by chunk into its slot of the download buffer."""
+        position = 0
+        for chunk in body.iter_chunks(S3_CHUNK_SIZE):
+            target[position:position + len(chunk)] = chunk
+            position += len(chunk)
+        if position != len(target):
+            raise IOError(f"Expected {len(target)} bytes from S3, received {position}")
+    
+    def _download_range(self, s3_key: str, target: memoryview, start: int):
+        response = self.s3_client.get_object(
+            Bucket=self.bucket_name,
+            Key=s3_key,
+            Range=f"bytes={start}-{start + len(target) - 1}"
+        )
+        self._read_body_into(response['Body'], target)
+    
+    def download_image_from_s3(self, s3_key: str) -> Optional[memoryview]:
+        """
+        Download image from S3 into a single preallocated buffer.
+        
+        The first part is requested with a ranged GET, which also reveals the object
+        size. Objects larger than one part have their remaining parts downloaded in
+        parallel, each straight into its slice of the buffer.
         
         Args:
             s3_key: S3 key of the image to download
             
         Returns:
-            Image data as bytes, or None if download failed
+            Image data as a memoryview, or None if download failed
         """
         try:
             logger.info(f"Downloading image from S3: {s3_key}")
             
-            response = self.s3_client.get_object(Bucket=self.bucket_name, Key=s3_key)
-            image_data = response['Body'].read()
+            response = self.s3_client.get_object(
+                Bucket=self.bucket_name,
+                Key=s3_key,
+                Range=f"bytes=0-{self.s3_part_size - 1}"
+            )
+            # Content-Range is "bytes 0-<end>/<size>"
+            size = int(response['ContentRange'].rsplit('/', 1)[1])
+            image_data = memoryview(bytearray(size))
+            first_part = min(size, self.s3_part_size)
+            self._read_body_into(response['Body'], image_data[:first_part])
             
-            logger.info(f"Successfully downloaded image: {len(image_data)} bytes")
+            remaining_parts = range(first_part, size, self.s3_part_size)
+            if remaining_parts:
+                with ThreadPoolExecutor(max_workers=min(self.s3_max_concurrency, len(remaining_parts))) as executor:
+                    futures = [
+                        executor.submit(
+                            self._download_range, s3_key, image_data[start:start + self.s3_part_size], start
+                        )
+                        for start in remaining_parts
+                    ]
+                    for future in futures:
+                        future.result()
+            
+            logger.info(f"Successfully downloaded image: {size} bytes in {len(remaining_parts) + 1} parts")
             return image_data
             
         except ClientError as e:
@@ -172,9 +289,12 @@ class BatchProcessor:
             logger.error(f"Unexpected error downloading image: {str(e)}")
             return None
     
-    def process_image(self, image_data: bytes) -> Dict[str, Any]:
+    def process_image(self, image_data: memoryview) -> Dict[str, Any]:
         """
-        Process the image data by sending it to the prediction service.
+        Process the image data with the configured inference backend.
+        
+        Inference runs on a downscaled, upright derivative of the image (unless
+        DERIVATIVE_MAX_SIDE is 0) and the boxes are mapped back to the original.
         
         Args:
             image_data: Raw image data
@@ -187,65 +307,84 @@ class BatchProcessor:
         start_time = time.perf_counter()
         
         try:
-            files = {
-                'image': ('image.jpg', io.BytesIO(image_data), 'image/jpeg')
-            }
+            derivative = None
+            if self.derivative_max_side > 0:
+                derivative = create_derivative(image_data, self.derivative_max_side, self.derivative_quality)
+                logger.info(f"Created {derivative.size[0]}x{derivative.size[1]} derivative ({len(derivative.data)} bytes) "
+                            f"of {derivative.original_size[0]}x{derivative.original_size[1]} image")
             
-            prediction_url = os.environ.get('PREDICTION_URL', 'http://localhost:3000/predict')
-            logger.info(f"Sending request to: {prediction_url}")
+            prediction_results = self.inference_backend.predict(derivative.data if derivative else image_data)
+            logger.info(f"Prediction successful: received {len(prediction_results)} objects")
             
-            response = requests.post(
-                prediction_url,
-                files=files,
-                timeout=30
-            )
+            end_time = time.perf_counter()
+            processing_time = end_time - start_time
             
-            if response.status_code == 200:
-                prediction_results = response.json()
-                logger.info(f"Prediction successful: received {len(prediction_results)} objects")
-                
-                end_time = time.perf_counter()
-                processing_time = end_time - start_time
-                
-                objects = []
-                for obj in prediction_results:
-                    box = obj.get('box', {})
-                    objects.append({
-                        'x1': int(box.get('x1', 0)),
-                        'y1': int(box.get('y1', 0)),
-                        'x2': int(box.get('x2', 0)),
-                        'y2': int(box.get('y2', 0)),
-                        'healthy_score': float(obj.get('healthy_score', 0.0)),
-                        'damaged_score': float(obj.get('damaged_score', 0.0)),
-                    })
-                
-                processing_results = {
-                    'processed_at': datetime.now().isoformat() + 'Z',
-                    'processing_time': str(processing_time),
-                    'image_size': len(image_data),
-                    'objects': objects
-                }
-                
-                logger.info(f"Image processing completed: found {len(objects)} objects")
-                return processing_results
-                
-            else:
-                logger.error(f"Prediction service returned error: {response.status_code} - {response.text}")
-                raise Exception(f"Prediction service failed with status {response.status_code}")
+            objects = []
+            for obj in prediction_results:
+                box = obj.get('box', {})
+                box = {key: box.get(key, 0) for key in ('x1', 'y1', 'x2', 'y2')}
+                if derivative:
+                    box = derivative.to_original_box(box)
+                objects.append({
+                    'x1': int(box['x1']),
+                    'y1': int(box['y1']),
+                    'x2': int(box['x2']),
+                    'y2': int(box['y2']),
+                    'healthy_score': float(obj.get('healthy_score', 0.0)),
+                    'damaged_score': float(obj.get('damaged_score', 0.0)),
+                })
+            
+            processing_results = {
+                'processed_at': datetime.now().isoformat() + 'Z',
+                'processing_time': str(processing_time),
+                'image_size': len(image_data),
+                'objects': objects
+            }
+            
+            logger.info(f"Image processing completed: found {len(objects)} objects")
+            return processing_results
                 
-        except requests.exceptions.Timeout:
-            logger.error("Request to prediction service timed out")
-            raise Exception("Prediction service timeout")
-        except requests.exceptions.ConnectionError:
-            logger.error("Failed to connect to prediction service")
-            raise Exception("Cannot connect to prediction service")
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Request to prediction service failed: {str(e)}")
-            raise Exception(f"Prediction service request failed: {str(e)}")
         except Exception as e:
             logger.error(f"Unexpected error during image processing: {str(e)}")
             raise
     
+    def link_duplicate(self, report_data: Dict[str, Any], image_data: memoryview) -> Optional[int]:
+        """
+        Record the perceptual hash of the report's image and link the report to an
+        already processed report of the same scene, if there is one.
+        
+        The database only compares the hash with reports within DEDUP_RADIUS_METERS
+        (found through the location index), and accepts one that differs by at most
+        DEDUP_MAX_DISTANCE bits. A linked report is marked processed and shares the
+        objects of the original, so it needs no inference.
+        
+        Args:
+            report_data: Original report data
+            image_data: Raw image data
+            
+        Returns:
+            Id of the original report, or None if the report is not a duplicate
+            (or the lookup failed, in which case the report is processed normally)
+        """
+        start_time = time.perf_counter()
+        try:
+            image_phash = perceptual_hash(image_data)
+            response = self.supabase_client.rpc('link_duplicate_report', {
+                'image_name': report_data.get('image'),
+                'image_phash': image_phash,
+                'max_distance': self.dedup_max_distance,
+                'radius_meters': self.dedup_radius_meters,
+                'processing_time': str(time.perf_counter() - start_time),
+                'image_size': len(image_data)
+            }).execute()
+            if response.data is not None:
+                logger.info(f"Image {report_data.get('image')} duplicates report {response.data}, reusing its results")
+            return response.data
+        
+        except Exception as e:
+            logger.warning(f"Duplicate lookup failed, running inference: {str(e)}")
+            return None
+    
     def publish_to_supabase(self, report_data: Dict[str, Any], processing_results: Dict[str, Any]) -> bool:
         """
         Publish the processed report to Supabase using RPC function.
@@ -271,7 +410,6 @@ class BatchProcessor:
             processing_time = processing_results.get('processing_time', None)
             image_size = processing_results.get('image_size', None)
             objects = [{
-                'image_name': s3_key,
                 'x1': obj.get('x1'),
                 'y1': obj.get('y1'),
                 'x2': obj.get('x2'),
@@ -280,20 +418,14 @@ class BatchProcessor:
                 'damaged_score': obj.get('damaged_score'),
             } for obj in processing_results.get('objects', [])]
 
-            response = self.supabase_client.rpc('process_report', {
+            # Updates the report and inserts all its objects in a single transaction
+            response = self.supabase_client.rpc('process_report_with_objects', {
                 'image_name': s3_key,
                 'processing_time': processing_time,
-                'image_size': image_size
+                'image_size': image_size,
+                'report_objects': objects
             }).execute()
-            if response.data:
-                logger.info(f"Successfully published processing results to DB: {response.data}")
-
-            for obj in objects:
-                response = self.supabase_client.rpc('insert_object_by_image_name', obj).execute()
-                if response.data:
-                    logger.info(f"Successfully published object to DB: {response.data}")
-                else:
-                    logger.error(f"Failed to publish object: {obj}")
+            logger.info(f"Successfully published processing results and {response.data} objects to DB")
             return True
         
         except Exception as e:
@@ -325,6 +457,10 @@ class BatchProcessor:
                 logger.error("Failed to download image, skipping message")
                 return False
             
+            if self.dedup_radius_meters > 0 and self.link_duplicate(message_body, image_data) is not None:
+                logger.info("Message processed successfully")
+                return True
+            
             try:
                 processing_results = self.process_image(image_data)
             except Exception as e:
@@ -347,37 +483,79 @@ class BatchProcessor:
             logger.error(f"Unexpected error processing message: {str(e)}")
             return False
 
+    def finish_message(self, message: Dict[str, Any], success: bool):
+        """
+        Queue a message for deletion if it was processed successfully.
+        
+        Args:
+            message: SQS message dictionary
+            success: Whether the message was processed successfully
+        """
+        message_id = message.get('MessageId')
+        if success:
+            receipt_handle = message.get('ReceiptHandle')
+            if receipt_handle:
+                with self.lease_lock:
+                    self.pending_deletes[message_id] = receipt_handle
+                    flush = len(self.pending_deletes) >= SQS_MAX_MESSAGES
+                if flush:
+                    self.delete_messages()
+            else:
+                logger.warning("No receipt handle found for message")
+        else:
+            # Stop extending its visibility so it is redelivered once the timeout runs out
+            with self.lease_lock:
+                self.leased_messages.pop(message_id, None)
+            logger.warning("Message processing failed, leaving in queue for retry")
+
     def run(self):
         """
         Main processing loop.
+        
+        Up to `workers` messages are processed concurrently, so the S3 download,
+        inference and publish stages of different messages overlap. New messages
+        are only received when a worker is free, so none wait in memory while
+        their visibility timeout runs out.
         """
-        logger.info("Starting batch processor...")
+        logger.info(f"Starting batch processor with {self.workers} workers...")
+        in_flight = {}
+        stop_heartbeat = threading.Event()
+        heartbeat_thread = threading.Thread(target=self.heartbeat, args=(stop_heartbeat,), daemon=True)
+        heartbeat_thread.start()
         
-        while True:
-            try:
-                messages = self.receive_messages()
-                
-                if not messages:
-                    logger.info("No messages received")
-                    break
-                
-                for message in messages:
-                    success = self.process_message(message)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while True:
+                try:
+                    free_workers = self.workers - len(in_flight)
+                    if free_workers > 0:
+                        # Only long poll when there is nothing else to wait for
+                        messages = self.receive_messages(
+                            max_messages=min(free_workers, SQS_MAX_MESSAGES),
+                            wait_time=1 if in_flight else 20
+                        )
+                        if not messages and not in_flight:
+                            logger.info("No messages received")
+                            break
+                        for message in messages:
+                            in_flight[executor.submit(self.process_message, message)] = message
                     
-                    # Delete message if processing was successful
-                    if success:
-                        receipt_handle = message.get('ReceiptHandle')
-                        if receipt_handle:
-                            self.delete_message(receipt_handle)
-                            logger.info(f"Deleted message from queue: {message.get('MessageId')}")
-                        else:
-                            logger.warning("No receipt handle found for message")
-                    else:
-                        logger.warning("Message processing failed, leaving in queue for retry")
-                    
-            except Exception as e:
-                logger.error(f"Unexpected error in main loop: {str(e)}")
-                break
+                    if in_flight:
+                        # Keep polling for new messages while some workers are idle
+                        timeout = None if len(in_flight) >= self.workers else 0
+                        done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            self.finish_message(in_flight.pop(future), future.result())
+                        
+                except Exception as e:
+                    logger.error(f"Unexpected error in main loop: {str(e)}")
+                    break
+            
+            for future, message in in_flight.items():
+                self.finish_message(message, future.result())
+        
+        stop_heartbeat.set()
+        heartbeat_thread.join()
+        self.delete_messages()
 
 def main():
     """Main entry point."""
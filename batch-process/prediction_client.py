@@ -0,0 +1,204 @@
+"""
+HTTP client for the pipeline service's /predict endpoint.
+
+Shared by the batch processor and the analysis scripts. It keeps a pooled
+requests.Session so connections are reused across images, retries transient
+failures with jittered exponential backoff (predictions have no side effects,
+so retrying the POST is safe) and records the latency of every request.
+"""
+
+import io
+import os
+import time
+import uuid
+import random
+import logging
+import threading
+from collections import deque
+from typing import Dict, Any, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+LATENCY_WINDOW = 10000
+
+
+class PredictionError(Exception):
+    """The prediction service could not process the image."""
+
+
+class BufferReader(io.RawIOBase):
+    """
+    Read-only, seekable file object over one or more bytes-like buffers.
+
+    Unlike io.BytesIO it does not copy the buffers, so a downloaded image can be
+    decoded or streamed as a request body without materializing another copy.
+    """
+
+    def __init__(self, *buffers):
+        super().__init__()
+        self.buffers = [memoryview(buffer).cast('B') for buffer in buffers]
+        self.size = sum(len(buffer) for buffer in self.buffers)
+        self.position = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self.position = max(0, offset)
+        return self.position
+
+    def readinto(self, target) -> int:
+        target = memoryview(target).cast('B')
+        written = 0
+        start = 0
+        for buffer in self.buffers:
+            end = start + len(buffer)
+            if self.position < end and written < len(target):
+                offset = self.position - start
+                count = min(len(buffer) - offset, len(target) - written)
+                target[written:written + count] = buffer[offset:offset + count]
+                written += count
+                self.position += count
+            start = end
+        return written
+
+
+class PredictionClient:
+    def __init__(
+        self,
+        prediction_url: Optional[str] = None,
+        timeout: Optional[float] = None,
+        pool_size: Optional[int] = None,
+        max_retries: Optional[int] = None,
+        backoff_seconds: Optional[float] = None,
+        max_backoff_seconds: Optional[float] = None,
+    ):
+        """
+        Settings not given explicitly are read from the PREDICTION_* environment variables.
+        """
+        self.prediction_url = prediction_url or os.environ.get('PREDICTION_URL', 'http://localhost:3000/predict')
+        self.timeout = timeout or float(os.environ.get('PREDICTION_TIMEOUT', 30))
+        self.pool_size = pool_size or int(os.environ.get('PREDICTION_POOL_SIZE', 10))
+        self.max_retries = max_retries if max_retries is not None else int(os.environ.get('PREDICTION_MAX_RETRIES', 3))
+        self.backoff_seconds = backoff_seconds or float(os.environ.get('PREDICTION_BACKOFF_SECONDS', 0.5))
+        self.max_backoff_seconds = max_backoff_seconds or float(os.environ.get('PREDICTION_MAX_BACKOFF_SECONDS', 10))
+
+        self.session = requests.Session()
+        # Retries are handled in predict, so the adapter only provides the connection pool
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.retries = 0
+        self.failures = 0
+        self.lock = threading.Lock()
+
+    def backoff(self, attempt: int, response: Optional[requests.Response] = None) -> float:
+        """Full jitter exponential backoff, honoring a numeric Retry-After header."""
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), self.max_backoff_seconds)
+        return random.uniform(0, min(self.max_backoff_seconds, self.backoff_seconds * 2 ** attempt))
+
+    def multipart_body(self, image_data, filename: str) -> Tuple[BufferReader, str]:
+        """Multipart form with the image as its only field, streamed from the image buffer."""
+        boundary = uuid.uuid4().hex
+        header = (
+            f'--{boundary}\r\n'
+            f'Content-Disposition: form-data; name="image"; filename="{filename}"\r\n'
+            'Content-Type: image/jpeg\r\n\r\n'
+        ).encode()
+        footer = f'\r\n--{boundary}--\r\n'.encode()
+        return BufferReader(header, image_data, footer), f'multipart/form-data; boundary={boundary}'
+
+    def predict(self, image_data: bytes, filename: str = 'image.jpg') -> List[Dict[str, Any]]:
+        """
+        Run the pipeline on one image.
+
+        Args:
+            image_data: Raw image data
+            filename: File name sent with the multipart upload
+
+        Returns:
+            Detected objects as returned by the pipeline service
+        """
+        return self.predict_timed(image_data, filename)[0]
+
+    def predict_timed(self, image_data: bytes, filename: str = 'image.jpg') -> Tuple[List[Dict[str, Any]], float]:
+        """
+        Like predict, but also returns the latency in seconds of the successful request.
+        """
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            response = None
+            start_time = time.perf_counter()
+            body, content_type = self.multipart_body(image_data, filename)
+            try:
+                response = self.session.post(
+                    self.prediction_url,
+                    data=body,
+                    headers={'Content-Type': content_type},
+                    timeout=self.timeout
+                )
+                latency = time.perf_counter() - start_time
+                if response.status_code == 200:
+                    results = response.json()
+                    with self.lock:
+                        self.latencies.append(latency)
+                    return results, latency
+                error = f"Prediction service failed with status {response.status_code}: {response.text}"
+                retryable = response.status_code in RETRYABLE_STATUSES
+            except requests.exceptions.Timeout:
+                error = "Prediction service timeout"
+                retryable = True
+            except requests.exceptions.ConnectionError:
+                error = "Cannot connect to prediction service"
+                retryable = True
+            except requests.exceptions.RequestException as e:
+                error = f"Prediction service request failed: {str(e)}"
+                retryable = False
+
+            if not retryable or last_attempt:
+                with self.lock:
+                    self.failures += 1
+                logger.error(error)
+                raise PredictionError(error)
+
+            delay = self.backoff(attempt, response)
+            with self.lock:
+                self.retries += 1
+            logger.warning(f"{error}, retrying in {delay:.2f}s (attempt {attempt + 1}/{self.max_retries})")
+            time.sleep(delay)
+
+    def stats(self) -> Dict[str, Any]:
+        """Request count, retries, failures and latency percentiles (in seconds) of successful requests."""
+        with self.lock:
+            latencies = sorted(self.latencies)
+            stats = {'requests': len(latencies), 'retries': self.retries, 'failures': self.failures}
+        if latencies:
+            stats.update({
+                'mean': sum(latencies) / len(latencies),
+                'p50': latencies[int(0.50 * (len(latencies) - 1))],
+                'p95': latencies[int(0.95 * (len(latencies) - 1))],
+                'p99': latencies[int(0.99 * (len(latencies) - 1))],
+                'max': latencies[-1],
+            })
+        return stats
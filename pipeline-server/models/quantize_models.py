@@ -0,0 +1,193 @@
+"""
+Build INT8 variants of the detector and classifier and register the ones that pass the accuracy gate.
+
+Each model is quantized dynamically and statically (calibrated on a sample of the test dataset).
+Every variant is evaluated with the analysis metrics against the FP32 pipeline and saved as its own
+BentoML model (e.g. detector_int8_static) only if it does not lose more than --max-delta of mAP_50
+or per-class F1.
+
+Usage (from pipeline-server):
+    python models/quantize_models.py --images <dataset>/test/images --labels <dataset>/test/labels
+"""
+import argparse
+import glob
+import os
+import random
+import sys
+
+import bentoml
+import cv2
+import numpy as np
+import onnx
+import onnxruntime as ort
+import pandas as pd
+from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_dynamic, quantize_static
+from onnxruntime.quantization.shape_inference import quant_pre_process
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.join(ROOT_DIR, "pipeline-server", "pipeline_service"))
+sys.path.append(os.path.join(ROOT_DIR, "analysis"))
+
+from classification_utils import preprocess_crops
+from detection_utils import postprocess, preprocess
+from group_metrics_calculation import calculate_basic_classification_metrics, calculate_map_metrics
+from models import APIResponse, BBox
+from process_predictions import load_gt_bboxes, process_predictions_of_image, read_image_shape
+
+MODELS = {
+    "detector": "./models/detector.onnx",
+    "classifier": "./models/classifier.onnx",
+}
+QUANTIZATION_MODES = ["dynamic", "static"]
+# Only the backbone is quantized, the NMS subgraph of the detector stays in float
+STATIC_OP_TYPES = ["Conv", "MatMul", "Gemm"]
+
+def read_rgb(image_path: str) -> np.ndarray:
+    return cv2.cvtColor(cv2.imread(image_path), cv2.COLOR_BGR2RGB)
+
+def label_path_for(image_path: str, labels_dir: str) -> str:
+    return os.path.join(labels_dir, os.path.basename(image_path).replace(".jpg", ".txt"))
+
+class DetectorCalibrationReader(CalibrationDataReader):
+    def __init__(self, input_name: str, image_paths: list[str]):
+        self.input_name = input_name
+        self.image_paths = iter(image_paths)
+
+    def get_next(self):
+        image_path = next(self.image_paths, None)
+        if image_path is None:
+            return None
+        return {self.input_name: preprocess(read_rgb(image_path))[0]}
+
+class ClassifierCalibrationReader(CalibrationDataReader):
+    """Feeds the ground truth sign crops of each calibration image."""
+    def __init__(self, input_name: str, image_paths: list[str], labels_dir: str):
+        self.input_name = input_name
+        self.image_paths = iter(image_paths)
+        self.labels_dir = labels_dir
+
+    def get_next(self):
+        for image_path in self.image_paths:
+            pixels = read_rgb(image_path)
+            gt_bboxes = load_gt_bboxes(label_path_for(image_path, self.labels_dir), pixels.shape[:2])
+            crops = [
+                pixels[max(b.y1, 0):b.y2, max(b.x1, 0):b.x2] for _, b in gt_bboxes
+                if b.x2 > max(b.x1, 0) and b.y2 > max(b.y1, 0)
+            ]
+            if crops:
+                return {self.input_name: preprocess_crops(crops)}
+        return None
+
+def quantize(name: str, mode: str, calibration_paths: list[str], labels_dir: str, output_dir: str) -> str:
+    """Quantize one model and return the path of the INT8 variant."""
+    model_path = MODELS[name]
+    output_path = os.path.join(output_dir, f"{name}_int8_{mode}.onnx")
+    if mode == "dynamic":
+        quantize_dynamic(model_path, output_path, weight_type=QuantType.QUInt8)
+        return output_path
+
+    prepared_path = os.path.join(output_dir, f"{name}_prepared.onnx")
+    quant_pre_process(model_path, prepared_path)
+    input_name = onnx.load(prepared_path).graph.input[0].name
+    if name == "detector":
+        reader = DetectorCalibrationReader(input_name, calibration_paths)
+    else:
+        reader = ClassifierCalibrationReader(input_name, calibration_paths, labels_dir)
+    quantize_static(
+        prepared_path,
+        output_path,
+        reader,
+        quant_format=QuantFormat.QDQ,
+        op_types_to_quantize=STATIC_OP_TYPES,
+        per_channel=True,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+    )
+    return output_path
+
+def run_pipeline(detector: ort.InferenceSession, classifier: ort.InferenceSession, image_path: str) -> list[APIResponse]:
+    """Run the same detection and classification steps as PipelineService.predict."""
+    pixels = read_rgb(image_path)
+    img_array, *params = preprocess(pixels)
+    detections = detector.run(None, {detector.get_inputs()[0].name: img_array})[0][0]
+    boxes, confidences = postprocess(detections, *params)
+    boxes = boxes.astype(int)
+    if not len(boxes):
+        return []
+    crops = [pixels[y1:y2, x1:x2] for x1, y1, x2, y2 in boxes]
+    scores = classifier.run(None, {classifier.get_inputs()[0].name: preprocess_crops(crops)})[0][:, 0]
+    return [
+        APIResponse(
+            image=image_path,
+            bbox=BBox(*box),
+            confidence=float(conf),
+            cls_score=float(score),
+            damaged_score=float(conf * (1 - score)),
+            healthy_score=float(conf * score),
+        )
+        for box, conf, score in zip(boxes.tolist(), confidences, scores)
+    ]
+
+def evaluate(detector_path: str, classifier_path: str, image_paths: list[str], labels_dir: str) -> dict:
+    """Compute mAP_50 and per-class F1 of a detector/classifier pair on the evaluation images."""
+    detector = ort.InferenceSession(detector_path)
+    classifier = ort.InferenceSession(classifier_path)
+    results = []
+    for image_path in image_paths:
+        gt_bboxes = load_gt_bboxes(label_path_for(image_path, labels_dir), read_image_shape(image_path))
+        predictions = run_pipeline(detector, classifier, image_path)
+        results.extend(process_predictions_of_image(image_path, predictions, gt_bboxes))
+    df = pd.DataFrame([r.to_dict() for r in results])
+    basic_metrics = calculate_basic_classification_metrics(df)
+    map_metrics = calculate_map_metrics(df)
+    return {
+        "mAP_50": map_metrics["mAP_50"],
+        "f1_healthy": basic_metrics["f1_healthy"],
+        "f1_damaged": basic_metrics["f1_damaged"],
+    }
+
+def accuracy_loss(baseline: dict, metrics: dict) -> float:
+    return max(baseline[key] - metrics[key] for key in baseline)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", required=True, help="Directory with the test images")
+    parser.add_argument("--labels", required=True, help="Directory with the YOLO test labels")
+    parser.add_argument("--calibration-size", type=int, default=100, help="Number of images used for static calibration")
+    parser.add_argument("--max-delta", type=float, default=0.01, help="Maximum allowed loss of mAP_50 or per-class F1")
+    parser.add_argument("--output-dir", default="./models/quantized")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    image_paths = sorted(
+        p for p in glob.glob(os.path.join(args.images, "*.jpg"))
+        if os.path.exists(label_path_for(p, args.labels))
+    )
+    calibration_paths = random.Random(args.seed).sample(image_paths, min(args.calibration_size, len(image_paths)))
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    baseline = evaluate(MODELS["detector"], MODELS["classifier"], image_paths, args.labels)
+    print(f"FP32 baseline: {baseline}")
+
+    for name in MODELS:
+        for mode in QUANTIZATION_MODES:
+            variant_name = f"{name}_int8_{mode}"
+            variant_path = quantize(name, mode, calibration_paths, args.labels, args.output_dir)
+            # Each variant is paired with the FP32 version of the other model
+            pair = {**MODELS, name: variant_path}
+            metrics = evaluate(pair["detector"], pair["classifier"], image_paths, args.labels)
+            loss = accuracy_loss(baseline, metrics)
+            print(f"{variant_name}: {metrics} (max loss {loss:.4f})")
+            if loss > args.max_delta:
+                print(f"Rejected {variant_name}: loses more than {args.max_delta}")
+                continue
+            bentoml.onnx.save_model(
+                name=variant_name,
+                model=onnx.load(variant_path),
+                labels={"precision": "int8", "quantization": mode},
+                metadata={**metrics, "baseline": baseline, "max_loss": loss},
+            )
+            print(f"Saved {variant_name} to the BentoML model store")
+
+if __name__ == "__main__":
+    main()
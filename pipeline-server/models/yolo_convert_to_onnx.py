@@ -4,5 +4,5 @@ model = YOLO("./models/11S_best.pt")
 
 
 model.export(format="onnx", 
-             simplify=True, nms=True,
+             simplify=True, nms=True, dynamic=True,
              )
\ No newline at end of file
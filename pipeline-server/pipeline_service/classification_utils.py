@@ -4,35 +4,51 @@ import typing as t
 from pathlib import Path
 from bentoml.validators import ContentType
 import os
-os.environ["KERAS_BACKEND"] = "jax"
-from keras.preprocessing import image as keras_preprocessing_image
-from keras.applications import efficientnet
 
 import numpy as np
+import cv2
 from PIL import Image
 
 INPUT_SIZE = (380, 380)
 
+# 'lanczos' resizes with PIL's LANCZOS, which is what the classifier was trained on and gives
+# output identical to the original Keras preprocessing. The OpenCV filters are faster but
+# differ from it (by up to ~27 intensity levels on downscaled crops), so check the
+# classification metrics before switching to one of them.
+RESAMPLING_FILTERS = {
+    "lanczos": None,
+    "area": cv2.INTER_AREA,
+    "cubic": cv2.INTER_CUBIC,
+    "linear": cv2.INTER_LINEAR,
+    "nearest": cv2.INTER_NEAREST,
+}
+CLASSIFICATION_RESAMPLING = os.environ.get('CLASSIFICATION_RESAMPLING', 'lanczos')
+
 ImageType = t.Annotated[Path, ContentType("image/*")]
 
-def pre_preprocess_image(img):
-    """Format the image to a square to the EfficientNet input size."""
-    original_size = img.size
-    max_side = max(original_size)
-    new_img = Image.new("RGB", (max_side, max_side), (0, 0, 0))
-    paste_position = (
-        (max_side - original_size[0]) // 2,
-        (max_side - original_size[1]) // 2
+def pre_preprocess_image(img: np.ndarray, resampling: str = CLASSIFICATION_RESAMPLING) -> np.ndarray:
+    """Format the HxWx3 RGB crop to a square to the EfficientNet input size."""
+    h, w = img.shape[:2]
+    max_side = max(h, w)
+    pad_top = (max_side - h) // 2
+    pad_left = (max_side - w) // 2
+    new_img = cv2.copyMakeBorder(
+        img, pad_top, max_side - h - pad_top, pad_left, max_side - w - pad_left,
+        cv2.BORDER_CONSTANT, value=(0, 0, 0)
     )
-    new_img.paste(img, paste_position)
-    new_img = new_img.resize(INPUT_SIZE, Image.LANCZOS)
-    return new_img
+    interpolation = RESAMPLING_FILTERS[resampling]
+    if interpolation is None:
+        return np.asarray(Image.fromarray(new_img).resize(INPUT_SIZE, Image.LANCZOS))
+    return cv2.resize(new_img, INPUT_SIZE, interpolation=interpolation)
 
-def preprocess_image(img):
+def preprocess_image(img: np.ndarray) -> np.ndarray:
     """Preprocess the image for EfficientNet."""
-    new_img = pre_preprocess_image(img)
-    img_array = keras_preprocessing_image.img_to_array(new_img)
-    img_array = efficientnet.preprocess_input(img_array)
-    img_array = np.expand_dims(img_array, axis=0)
-    return img_array
+    # EfficientNet rescales inside the model, so keras' preprocess_input is the identity
+    return pre_preprocess_image(img)[None, ...].astype(np.float32)
 
+def preprocess_crops(crops: list[np.ndarray]) -> np.ndarray:
+    """Preprocess decoded RGB crops into a single EfficientNet batch."""
+    batch = np.empty((len(crops), *INPUT_SIZE, 3), dtype=np.float32)
+    for slot, crop in zip(batch, crops):
+        slot[...] = pre_preprocess_image(crop)
+    return batch
@@ -1,42 +1,71 @@
 # pipeline-server/pipeline_service/detection_utils.py
 import numpy as np
-from PIL import Image
 import cv2
 
-def letterbox(im: np.ndarray, new_shape=(640, 640), color=(114,114,114)):
-    """Format image to YOLOv11 letterboxed input size."""
+INPUT_SIZE = 640
+
+def letterbox_into(out: np.ndarray, im: np.ndarray, color=(114,114,114)):
+    """Letterbox an HxWx3 uint8 image into a preallocated 3xHxW float32 slot normalized to [0, 1]."""
+    _, nh, nw = out.shape
     h0, w0 = im.shape[:2]
-    nh, nw = new_shape
     r = min(nh / h0, nw / w0)
     new_unpad = (int(round(w0 * r)), int(round(h0 * r)))
     resized = cv2.resize(im, new_unpad, interpolation=cv2.INTER_LINEAR)
-    pad_w = nw - new_unpad[0]
-    pad_h = nh - new_unpad[1]
-    pad_left = pad_w // 2
-    pad_top = pad_h // 2
-    out = np.full((nh, nw, 3), color, dtype=im.dtype)
-    out[pad_top:pad_top+new_unpad[1], pad_left:pad_left+new_unpad[0]] = resized
-    return out, r, pad_top, pad_left
-
-def preprocess(img: Image.Image, size=640):
-    """Preprocess the image for YOLOv11."""
-    img = img.convert("RGB")
-    orig_w, orig_h = img.size
-    im = np.asarray(img)
-    letterboxed_image, r, pad_top, pad_left = letterbox(im, new_shape=(size, size))
-    arr = letterboxed_image.astype(np.float32) / 255.0 # Normalize to [0, 1]
-    arr = arr.transpose(2,0,1)[None, ...]  # convert HxWxC to 1xCxHxW
+    pad_left = (nw - new_unpad[0]) // 2
+    pad_top = (nh - new_unpad[1]) // 2
+    bottom = pad_top + new_unpad[1]
+    right = pad_left + new_unpad[0]
+    # Only the padding is filled, the resized image is written over the rest
+    pad = (np.asarray(color, dtype=np.float32) / 255.0)[:, None, None]
+    out[:, :pad_top] = pad
+    out[:, bottom:] = pad
+    out[:, pad_top:bottom, :pad_left] = pad
+    out[:, pad_top:bottom, right:] = pad
+    # Fused uint8 -> float32 conversion, normalization and HxWxC -> CxHxW transpose
+    np.divide(resized.transpose(2, 0, 1), np.float32(255.0), out=out[:, pad_top:bottom, pad_left:right])
+    return r, pad_top, pad_left
+
+def letterbox(im: np.ndarray, size=INPUT_SIZE, color=(114,114,114)):
+    """
+    Letterbox an HxWx3 uint8 image into a compact size x size x 3 uint8 canvas.
+    Returns the canvas and the (orig_w, orig_h, r, pad_top, pad_left) params that map boxes back.
+    """
+    h0, w0 = im.shape[:2]
+    r = min(size / h0, size / w0)
+    new_unpad = (int(round(w0 * r)), int(round(h0 * r)))
+    resized = cv2.resize(im, new_unpad, interpolation=cv2.INTER_LINEAR)
+    pad_left = (size - new_unpad[0]) // 2
+    pad_top = (size - new_unpad[1]) // 2
+    canvas = cv2.copyMakeBorder(
+        resized, pad_top, size - new_unpad[1] - pad_top, pad_left, size - new_unpad[0] - pad_left,
+        cv2.BORDER_CONSTANT, value=color
+    )
+    return canvas, (w0, h0, r, pad_top, pad_left)
+
+def normalize_into(out: np.ndarray, canvas: np.ndarray):
+    """Convert a letterboxed HxWx3 uint8 canvas into a preallocated 3xHxW float32 slot normalized to [0, 1]."""
+    np.divide(canvas.transpose(2, 0, 1), np.float32(255.0), out=out)
+
+def preprocess_into(out: np.ndarray, im: np.ndarray):
+    """Preprocess the decoded RGB image for YOLOv11 into a slot of a preallocated batch buffer."""
+    orig_h, orig_w = im.shape[:2]
+    r, pad_top, pad_left = letterbox_into(out, im)
+    return orig_w, orig_h, r, pad_top, pad_left
+
+def preprocess(im: np.ndarray, size=INPUT_SIZE):
+    """Preprocess the decoded RGB image for YOLOv11."""
+    arr = np.empty((1, 3, size, size), dtype=np.float32)
+    orig_w, orig_h, r, pad_top, pad_left = preprocess_into(arr[0], im)
     return arr, orig_w, orig_h, r, pad_top, pad_left
 
-def unletterbox(x1, y1, x2, y2, r, pad_top, pad_left, orig_w, orig_h):
-    """Convert box coordinates from letterboxed image to original image size."""
-    x1p = (x1 - pad_left) / r
-    y1p = (y1 - pad_top) / r
-    x2p = (x2 - pad_left) / r
-    y2p = (y2 - pad_top) / r
-
-    x1o = max(min(x1p, orig_w), 0)
-    y1o = max(min(y1p, orig_h), 0)
-    x2o = max(min(x2p, orig_w), 0)
-    y2o = max(min(y2p, orig_h), 0)
-    return x1o, y1o, x2o, y2o
\ No newline at end of file
+def unletterbox(boxes: np.ndarray, r, pad_top, pad_left, orig_w, orig_h) -> np.ndarray:
+    """Convert Nx4 box coordinates from letterboxed image to original image size."""
+    boxes = (boxes.astype(np.float64) - (pad_left, pad_top, pad_left, pad_top)) / r
+    np.clip(boxes, 0, (orig_w, orig_h, orig_w, orig_h), out=boxes)
+    return boxes
+
+def postprocess(detections: np.ndarray, orig_w, orig_h, r, pad_top, pad_left):
+    """Drop empty NMS slots and map the remaining boxes back to the original image."""
+    detections = detections[detections[:, 4] > 0.0]
+    boxes = unletterbox(detections[:, :4], r, pad_top, pad_left, orig_w, orig_h)
+    return boxes, detections[:, 4]
@@ -0,0 +1,147 @@
+# pipeline-server/pipeline_service/result_cache.py
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+def hash_file(path: Path, *salt: str) -> str:
+    """SHA-256 of the file contents, salted with e.g. the model tags that produced the results."""
+    digest = hashlib.sha256()
+    for value in salt:
+        digest.update(value.encode("utf-8"))
+        digest.update(b"\0")
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class DiskCache:
+    """Directory of JSON results with TTL and size based (oldest first) eviction."""
+    def __init__(self, directory: str, ttl_seconds: float, max_bytes: int):
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        # Guards total_bytes, which is updated by concurrent requests
+        self.lock = threading.Lock()
+        self.total_bytes = sum(entry.stat().st_size for entry in self._entries())
+
+    def _entries(self):
+        return (entry for entry in os.scandir(self.directory) if entry.name.endswith(".json"))
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key: str) -> Optional[list]:
+        path = self._path(key)
+        try:
+            stat = os.stat(path)
+            if time.time() - stat.st_mtime > self.ttl_seconds:
+                os.remove(path)
+                with self.lock:
+                    self.total_bytes -= stat.st_size
+                return None
+            with open(path, "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def put(self, key: str, value: list):
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(value, f)
+        size = os.path.getsize(tmp_path)
+        os.replace(tmp_path, path)
+        with self.lock:
+            self.total_bytes += size
+            over_limit = self.total_bytes > self.max_bytes
+        if over_limit:
+            self.evict()
+
+    def evict(self):
+        """Drop expired entries, then the oldest ones until the cache is back under 90% of its size limit."""
+        with self.lock:
+            now = time.time()
+            entries = sorted(
+                ((entry.stat().st_mtime, entry.stat().st_size, entry.path) for entry in self._entries())
+            )
+            self.total_bytes = sum(size for _, size, _ in entries)
+            for mtime, size, path in entries:
+                if now - mtime <= self.ttl_seconds and self.total_bytes <= self.max_bytes * 0.9:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                self.total_bytes -= size
+
+class ResultCache:
+    """Bounded in-memory LRU of pipeline results backed by an optional on-disk tier."""
+    def __init__(self, max_entries: int, disk_cache: Optional[DiskCache] = None):
+        self.max_entries = max_entries
+        self.disk_cache = disk_cache
+        self.entries: OrderedDict[str, list] = OrderedDict()
+        self.lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[list]:
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.memory_hits += 1
+                return self.entries[key]
+        value = self.disk_cache.get(key) if self.disk_cache else None
+        with self.lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._put_in_memory(key, value)
+        return value
+
+    def put(self, key: str, value: list):
+        with self.lock:
+            self._put_in_memory(key, value)
+        if self.disk_cache:
+            self.disk_cache.put(key, value)
+
+    def _put_in_memory(self, key: str, value: list):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self.lock:
+            requests = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.memory_hits + self.disk_hits) / requests if requests else 0.0,
+                "memory_entries": len(self.entries),
+                "disk_bytes": self.disk_cache.total_bytes if self.disk_cache else 0,
+            }
+
+def create_result_cache() -> Optional[ResultCache]:
+    """Build the cache from the RESULT_CACHE_* environment variables, or None if it is disabled."""
+    if os.environ.get('RESULT_CACHE_ENABLED', 'false').lower() != 'true':
+        return None
+    disk_cache = None
+    cache_dir = os.environ.get('RESULT_CACHE_DIR')
+    if cache_dir:
+        disk_cache = DiskCache(
+            cache_dir,
+            ttl_seconds=float(os.environ.get('RESULT_CACHE_TTL_SECONDS', 7 * 24 * 3600)),
+            max_bytes=int(os.environ.get('RESULT_CACHE_MAX_BYTES', 512 * 1024 * 1024)),
+        )
+    return ResultCache(int(os.environ.get('RESULT_CACHE_SIZE', 1024)), disk_cache)
@@ -1,50 +1,88 @@
 # /pipeline-server/pipeline_service/service.py
-from classification_utils import preprocess_image
-from detection_utils import preprocess, unletterbox
+from classification_utils import CLASSIFICATION_RESAMPLING, preprocess_image, preprocess_crops
+from detection_utils import INPUT_SIZE, letterbox, normalize_into, postprocess
+from session_utils import create_session
+from result_cache import create_result_cache, hash_file
 import typing as t
-import onnxruntime as ort
+import os
+import asyncio
+import threading
+import numpy as np
 from pathlib import Path
 from bentoml.validators import ContentType
 import bentoml
-import asyncio
 from PIL import Image
 from dataclasses import dataclass
 
 ImageType = t.Annotated[Path, ContentType("image/*")]
 
-@bentoml.service()
+DETECTION_MODEL = os.environ.get('DETECTION_MODEL', 'detector:latest')
+CLASSIFICATION_MODEL = os.environ.get('CLASSIFICATION_MODEL', 'classifier:latest')
+DETECTION_MAX_BATCH_SIZE = int(os.environ.get('DETECTION_MAX_BATCH_SIZE', 8))
+# BentoML rejects queued requests (503) that would exceed this deadline, it is not a batch fill wait,
+# so it must stay well above the duration of a detector run
+DETECTION_MAX_LATENCY_MS = int(os.environ.get('DETECTION_MAX_LATENCY_MS', 60000))
+DETECTION_WORKERS = int(os.environ.get('DETECTION_WORKERS', 1))
+CLASSIFICATION_WORKERS = int(os.environ.get('CLASSIFICATION_WORKERS', 1))
+# Both model services share the node, so the cores are split across all their workers
+MODEL_WORKERS = DETECTION_WORKERS + CLASSIFICATION_WORKERS
+
+def decode_image(input: ImageType) -> np.ndarray:
+    """Decode the uploaded file once into an HxWx3 RGB array shared by both pipeline stages."""
+    with Image.open(input) as img:
+        return np.asarray(img.convert("RGB"))
+
+@bentoml.service(workers=DETECTION_WORKERS)
 class DetectionService:
     def __init__(self):
-        model_ref = bentoml.onnx.get("detector:latest")
-        self.session = ort.InferenceSession(model_ref.path_of("saved_model.onnx"))
+        model_ref = bentoml.onnx.get(DETECTION_MODEL)
+        self.session = create_session(model_ref, "DETECTION", workers=MODEL_WORKERS)
+        self.input_name = self.session.get_inputs()[0].name
+        # Models exported without dynamic axes only accept a fixed batch size
+        batch_dim = self.session.get_inputs()[0].shape[0]
+        self.session_batch_size = batch_dim if isinstance(batch_dim, int) else None
+        self.buffers = threading.local()
 
-    @bentoml.api(batchable=False)
-    def predict(self, input: ImageType) -> list[dict]:
-        input_name = self.session.get_inputs()[0].name
-        img_array, orig_w, orig_h, r, pad_top, pad_left = preprocess(Image.open(input))
-        outputs = self.session.run(None, {input_name: img_array})[0]
-        results = []
-        for det in outputs[0]:
-            x1, y1, x2, y2, conf, cls_id = det
-            if conf <= 0.0:
-                continue
-            x1o, y1o, x2o, y2o = unletterbox(x1, y1, x2, y2, r, pad_top, pad_left, orig_w, orig_h)
-            results.append({
-                "box": {
-                    "x1": float(x1o),
-                    "y1": float(y1o),
-                    "x2": float(x2o),
-                    "y2": float(y2o),
-                },
-                "confidence": float(conf)
-            })
-        return results
+    def get_input_buffer(self, batch_size: int) -> np.ndarray:
+        """Return a reusable per-thread Bx3xHxW input buffer with room for the batch."""
+        buffer = getattr(self.buffers, 'input', None)
+        if buffer is None or len(buffer) < batch_size:
+            buffer = np.empty((max(batch_size, DETECTION_MAX_BATCH_SIZE), 3, INPUT_SIZE, INPUT_SIZE), dtype=np.float32)
+            self.buffers.input = buffer
+        return buffer[:batch_size]
+
+    def run_batch(self, img_batch: np.ndarray) -> np.ndarray:
+        """Run the detector over a Bx3xHxW batch, chunking it if the model has a static batch size."""
+        if self.session_batch_size is None or self.session_batch_size == len(img_batch):
+            return self.session.run(None, {self.input_name: img_batch})[0]
+        step = self.session_batch_size
+        return np.concatenate([
+            self.session.run(None, {self.input_name: img_batch[i:i + step]})[0]
+            for i in range(0, len(img_batch), step)
+        ], axis=0)
+
+    @bentoml.api(
+        batchable=True,
+        batch_dim=0,
+        max_batch_size=DETECTION_MAX_BATCH_SIZE,
+        max_latency_ms=DETECTION_MAX_LATENCY_MS,
+    )
+    def predict(self, inputs: list[np.ndarray]) -> list[np.ndarray]:
+        """
+        Detect objects on letterboxed HxWx3 uint8 canvases.
+        Returns the Kx5 (x1, y1, x2, y2, confidence) detections of each canvas, in canvas coordinates.
+        """
+        img_batch = self.get_input_buffer(len(inputs))
+        for slot, canvas in zip(img_batch, inputs):
+            normalize_into(slot, canvas)
+        outputs = self.run_batch(img_batch)
+        return [detections[detections[:, 4] > 0.0, :5] for detections in outputs]
     
-@bentoml.service()
+@bentoml.service(workers=CLASSIFICATION_WORKERS)
 class ClassificationService:
     def __init__(self):
-        model_ref = bentoml.onnx.get("classifier:latest")
-        self.session = ort.InferenceSession(model_ref.path_of("saved_model.onnx"))
+        model_ref = bentoml.onnx.get(CLASSIFICATION_MODEL)
+        self.session = create_session(model_ref, "CLASSIFICATION", workers=MODEL_WORKERS)
 
     @bentoml.api(batchable=False)
     def predict(self, input: ImageType, crop=None) -> list[dict]:
@@ -52,8 +90,16 @@ class ClassificationService:
         image = Image.open(input)
         if crop is not None:
             image = image.crop(crop)
-        results = self.session.run(None, {input_name: preprocess_image(image)})
+        results = self.session.run(None, {input_name: preprocess_image(np.asarray(image.convert("RGB")))})
         return [dict(score=float(result[0][0])) for result in results]
+
+    @bentoml.api(batchable=False)
+    def predict_crops(self, crops: list[np.ndarray]) -> list[dict]:
+        if not crops:
+            return []
+        input_name = self.session.get_inputs()[0].name
+        scores = self.session.run(None, {input_name: preprocess_crops(crops)})[0]
+        return [dict(score=float(score[0])) for score in scores]
     
 @dataclass
 class BBox:
@@ -94,12 +140,20 @@ class PipelineService:
     detection_service = bentoml.depends(DetectionService)
     classification_service = bentoml.depends(ClassificationService)
 
-    async def classify_object(self, image: ImageType, object: DetectionObject) -> dict:
-        classification_result = (await self.classification_service.to_async.predict(image, crop=(
-            int(object.box.x1), int(object.box.y1), int(object.box.x2), int(object.box.y2)
-        )))[0]
+    def __init__(self):
+        self.result_cache = create_result_cache()
+        # Cached results are only valid for the exact models and preprocessing that produced them
+        self.cache_salt = [
+            str(bentoml.models.get(DETECTION_MODEL).tag),
+            str(bentoml.models.get(CLASSIFICATION_MODEL).tag),
+            CLASSIFICATION_RESAMPLING,
+        ] if self.result_cache is not None else []
+
+    def to_crop(self, pixels: np.ndarray, object: DetectionObject) -> np.ndarray:
+        return pixels[int(object.box.y1):int(object.box.y2), int(object.box.x1):int(object.box.x2)]
+
+    def to_classified_object(self, object: DetectionObject, score: float) -> dict:
         confidence = object.confidence
-        score = classification_result['score']
         return {
             "box": {
                 "x1": int(object.box.x1),
@@ -115,8 +169,41 @@ class PipelineService:
 
     @bentoml.api
     async def predict(self, image: ImageType) -> list[dict]:
-        detection_results = to_detection_result((await self.detection_service.to_async.predict(image)))
-        classification_results = await asyncio.gather(
-            *[self.classify_object(image, obj) for obj in detection_results.objects]
+        if self.result_cache is None:
+            return await self.run_pipeline(image)
+        # Hashing the upload and the disk tier do blocking file I/O, so they run off the event loop
+        cache_key = await asyncio.to_thread(hash_file, image, *self.cache_salt)
+        results = await asyncio.to_thread(self.result_cache.get, cache_key)
+        if results is None:
+            results = await self.run_pipeline(image)
+            await asyncio.to_thread(self.result_cache.put, cache_key, results)
+        return results
+
+    @bentoml.api
+    def cache_stats(self) -> dict:
+        if self.result_cache is None:
+            return {"enabled": False}
+        return {"enabled": True, **self.result_cache.stats()}
+
+    async def run_pipeline(self, image: ImageType) -> list[dict]:
+        pixels = decode_image(image)
+        # Only the compact 640x640 uint8 canvas crosses to the detector, boxes are mapped back here
+        canvas, letterbox_params = letterbox(pixels)
+        detections = (await self.detection_service.to_async.predict([canvas]))[0]
+        boxes, confidences = postprocess(detections, *letterbox_params)
+        detection_results = to_detection_result([
+            {
+                "box": {"x1": x1, "y1": y1, "x2": x2, "y2": y2},
+                "confidence": conf
+            }
+            for (x1, y1, x2, y2), conf in zip(boxes.tolist(), confidences.tolist())
+        ])
+        if not detection_results.objects:
+            return []
+        classification_results = await self.classification_service.to_async.predict_crops(
+            [self.to_crop(pixels, obj) for obj in detection_results.objects]
         )
-        return classification_results
\ No newline at end of file
+        return [
+            self.to_classified_object(obj, result['score'])
+            for obj, result in zip(detection_results.objects, classification_results)
+        ]
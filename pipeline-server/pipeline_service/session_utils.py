@@ -0,0 +1,67 @@
+# pipeline-server/pipeline_service/session_utils.py
+import os
+import tempfile
+import onnxruntime as ort
+
+GRAPH_OPTIMIZATION_LEVELS = {
+    "disable": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+EXECUTION_MODES = {
+    "sequential": ort.ExecutionMode.ORT_SEQUENTIAL,
+    "parallel": ort.ExecutionMode.ORT_PARALLEL,
+}
+
+def get_config(prefix: str, name: str, default=None):
+    """Read a service specific setting (e.g. DETECTION_ORT_INTRA_OP_THREADS), falling back to the shared one."""
+    return os.environ.get(f"{prefix}_{name}", os.environ.get(name, default))
+
+def available_cpus() -> int:
+    """Number of cores this process may run on, honoring container CPU affinity."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def create_session_options(prefix: str, workers: int = 1) -> tuple[ort.SessionOptions, str]:
+    """Build ONNX Runtime session options from the ORT_* environment variables."""
+    options = ort.SessionOptions()
+    level = get_config(prefix, "ORT_GRAPH_OPTIMIZATION_LEVEL", "all")
+    options.graph_optimization_level = GRAPH_OPTIMIZATION_LEVELS[level]
+    options.execution_mode = EXECUTION_MODES[get_config(prefix, "ORT_EXECUTION_MODE", "sequential")]
+    # By default each worker gets an even share of the cores so workers don't oversubscribe the node
+    options.intra_op_num_threads = int(get_config(prefix, "ORT_INTRA_OP_THREADS", max(1, available_cpus() // workers)))
+    options.inter_op_num_threads = int(get_config(prefix, "ORT_INTER_OP_THREADS", 1))
+    options.enable_cpu_mem_arena = get_config(prefix, "ORT_ENABLE_CPU_MEM_ARENA", "true").lower() == "true"
+    return options, level
+
+def create_session(model_ref, prefix: str, workers: int = 1) -> ort.InferenceSession:
+    """
+    Create an InferenceSession for a BentoML ONNX model.
+
+    The optimized graph is persisted to ORT_OPTIMIZED_MODEL_DIR so later cold starts
+    load it directly instead of optimizing the model again.
+    """
+    options, level = create_session_options(prefix, workers)
+    model_path = model_ref.path_of("saved_model.onnx")
+    cache_dir = get_config(prefix, "ORT_OPTIMIZED_MODEL_DIR", os.path.join(tempfile.gettempdir(), "ort-optimized"))
+    if not cache_dir or level == "disable":
+        return ort.InferenceSession(model_path, sess_options=options)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    cached_path = os.path.join(
+        cache_dir, f"{model_ref.tag.name}-{model_ref.tag.version}-ort{ort.__version__}-{level}.onnx"
+    )
+    if os.path.exists(cached_path):
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+        return ort.InferenceSession(cached_path, sess_options=options)
+
+    # Several workers may start at once, so each writes its own file and renames it atomically
+    tmp_path = f"{cached_path}.{os.getpid()}.tmp"
+    options.optimized_model_filepath = tmp_path
+    session = ort.InferenceSession(model_path, sess_options=options)
+    if os.path.exists(tmp_path):
+        os.replace(tmp_path, cached_path)
+    return session
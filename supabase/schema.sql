@@ -9,7 +9,9 @@ CREATE TABLE reports (
   processing_time INTERVAL DEFAULT NULL,
   image_size INTEGER DEFAULT NULL,
   address TEXT DEFAULT NULL,
-  description TEXT DEFAULT NULL
+  description TEXT DEFAULT NULL,
+  image_phash BIGINT DEFAULT NULL,
+  duplicate_of INTEGER DEFAULT NULL REFERENCES reports(id) ON DELETE SET NULL
 );
 
 CREATE INDEX reports_location_gix
@@ -63,6 +65,69 @@ BEGIN
 END;
 $$ LANGUAGE plpgsql;
 
+-- Links a report to an already processed report of the same scene: one taken within
+-- radius_meters whose image perceptual hash differs by at most max_distance bits.
+-- Candidates are narrowed down with reports_location_gix before hashes are compared.
+-- Returns the id of the original report, or NULL (after recording the hash) if there is none.
+CREATE OR REPLACE FUNCTION link_duplicate_report(
+  image_name TEXT,
+  image_phash BIGINT,
+  max_distance INTEGER DEFAULT 6,
+  radius_meters DOUBLE PRECISION DEFAULT 25,
+  processing_time INTERVAL DEFAULT NULL,
+  image_size INTEGER DEFAULT NULL
+) RETURNS INTEGER AS $$
+DECLARE
+  report reports%ROWTYPE;
+  original_id INTEGER;
+BEGIN
+  UPDATE reports
+  SET image_phash = link_duplicate_report.image_phash
+  WHERE reports.image_name = link_duplicate_report.image_name
+  RETURNING * INTO report;
+
+  IF NOT FOUND THEN
+    RAISE EXCEPTION 'No report found with image_name: %', image_name;
+  END IF;
+
+  SELECT COALESCE(candidates.duplicate_of, candidates.id) INTO original_id
+  FROM (
+    SELECT r.id, r.duplicate_of, r.location,
+           bit_count((r.image_phash # link_duplicate_report.image_phash)::bit(64)) AS hash_distance
+    FROM reports r
+    -- Bounding box in degrees, widened for the shorter longitude degrees away from the equator
+    WHERE r.location && ST_Expand(
+            report.location,
+            radius_meters / (111320 * GREATEST(cos(radians(ST_Y(report.location))), 0.01))
+          )
+      AND r.id <> report.id
+      AND r.state = 'processed'
+      AND r.image_phash IS NOT NULL
+  ) candidates
+  WHERE candidates.hash_distance <= max_distance
+    AND ST_DWithin(candidates.location::geography, report.location::geography, radius_meters)
+  ORDER BY candidates.hash_distance, ST_Distance(candidates.location::geography, report.location::geography)
+  LIMIT 1;
+
+  IF original_id IS NULL THEN
+    RETURN NULL;
+  END IF;
+
+  -- Objects of a previous attempt would be hidden by the link, so drop them
+  DELETE FROM objects WHERE objects.report_id = report.id;
+
+  UPDATE reports
+  SET state = 'processed',
+      processed_at = NOW(),
+      processing_time = link_duplicate_report.processing_time,
+      image_size = link_duplicate_report.image_size,
+      duplicate_of = original_id
+  WHERE reports.id = report.id;
+
+  RETURN original_id;
+END;
+$$ LANGUAGE plpgsql;
+
 CREATE TABLE objects (
   id SERIAL PRIMARY KEY,
   report_id INTEGER NOT NULL REFERENCES reports(id) ON DELETE CASCADE,
@@ -102,6 +167,50 @@ BEGIN
 END;
 $$ LANGUAGE plpgsql;
 
+CREATE OR REPLACE FUNCTION process_report_with_objects(
+  image_name TEXT,
+  processing_time INTERVAL,
+  image_size INTEGER,
+  report_objects JSONB DEFAULT '[]'::jsonb,
+  report_state VARCHAR DEFAULT 'processed'
+) RETURNS INTEGER AS $$
+DECLARE
+  report_count INTEGER;
+  inserted_count INTEGER;
+BEGIN
+  -- Drop objects from a previous attempt so retried messages don't duplicate them
+  DELETE FROM objects o
+  USING reports r
+  WHERE o.report_id = r.id AND r.image_name = process_report_with_objects.image_name;
+
+  WITH updated_report AS (
+    UPDATE reports
+    SET state = report_state,
+        processed_at = NOW(),
+        processing_time = process_report_with_objects.processing_time,
+        image_size = process_report_with_objects.image_size
+    WHERE reports.image_name = process_report_with_objects.image_name
+    RETURNING id
+  ), inserted_objects AS (
+    INSERT INTO objects (report_id, x1, x2, y1, y2, healthy_score, damaged_score)
+    SELECT updated_report.id, o.x1, o.x2, o.y1, o.y2, o.healthy_score, o.damaged_score
+    FROM updated_report
+    CROSS JOIN jsonb_to_recordset(report_objects) AS o(
+      x1 INTEGER, x2 INTEGER, y1 INTEGER, y2 INTEGER, healthy_score FLOAT, damaged_score FLOAT
+    )
+    RETURNING 1
+  )
+  SELECT (SELECT COUNT(*) FROM updated_report), (SELECT COUNT(*) FROM inserted_objects)
+  INTO report_count, inserted_count;
+
+  IF report_count = 0 THEN
+    RAISE EXCEPTION 'No report found with image_name: %', image_name;
+  END IF;
+
+  RETURN inserted_count;
+END;
+$$ LANGUAGE plpgsql;
+
 CREATE OR REPLACE FUNCTION get_report_details(
   report_uuid_param TEXT
 ) RETURNS JSON AS $$
@@ -111,18 +220,20 @@ DECLARE
   result JSON;
 BEGIN
   SELECT 
-    ST_X(location) as longitude,
-    ST_Y(location) as latitude,
-    report_uuid,
-    state,
-    reported_at,
-    processed_at,
-    address,
-    image_name,
-    description
+    ST_X(r.location) as longitude,
+    ST_Y(r.location) as latitude,
+    r.report_uuid,
+    r.state,
+    r.reported_at,
+    r.processed_at,
+    r.address,
+    -- Duplicates show the image of their original report, which their objects were detected on
+    COALESCE(original.image_name, r.image_name) as image_name,
+    r.description
   INTO report_record
-  FROM reports 
-  WHERE report_uuid = report_uuid_param;
+  FROM reports r
+  LEFT JOIN reports original ON original.id = r.duplicate_of
+  WHERE r.report_uuid = report_uuid_param;
 
   -- If no report found, return null
   IF NOT FOUND THEN
@@ -141,7 +252,8 @@ BEGIN
   ), '[]'::json)
   INTO objects_array
   FROM objects o
-  JOIN reports r ON o.report_id = r.id
+  -- Duplicates share the objects of their original report
+  JOIN reports r ON o.report_id = COALESCE(r.duplicate_of, r.id)
   WHERE r.report_uuid = report_uuid_param;
 
   result := json_build_object(
@@ -163,3 +275,39 @@ BEGIN
 END;
 $$ LANGUAGE plpgsql;
 
+CREATE OR REPLACE FUNCTION get_reports_details(
+  report_uuids TEXT[]
+) RETURNS SETOF JSON AS $$
+  SELECT json_build_object(
+    'location', json_build_object(
+      'lat', ST_Y(r.location),
+      'lng', ST_X(r.location)
+    ),
+    'report_uuid', r.report_uuid,
+    'state', r.state,
+    'reported_at', r.reported_at,
+    'processed_at', r.processed_at,
+    'address', r.address,
+    'image_name', COALESCE(original.image_name, r.image_name),
+    'description', r.description,
+    'objects', COALESCE(report_objects.objects, '[]'::json)
+  )
+  FROM reports r
+  -- Duplicates show the image of their original report, which their objects were detected on
+  LEFT JOIN reports original ON original.id = r.duplicate_of
+  LEFT JOIN LATERAL (
+    SELECT json_agg(
+      json_build_object(
+        'x1', o.x1,
+        'x2', o.x2,
+        'y1', o.y1,
+        'y2', o.y2,
+        'healthy_score', o.healthy_score,
+        'damaged_score', o.damaged_score
+      )
+    ) AS objects
+    FROM objects o
+    WHERE o.report_id = COALESCE(r.duplicate_of, r.id)
+  ) report_objects ON TRUE
+  WHERE r.report_uuid = ANY(report_uuids);
+$$ LANGUAGE sql STABLE;
@@ -1,96 +1,138 @@
 import json
-import boto3
+import math
 import os
 from datetime import datetime
+from lambda_utils import get_client, timed_handler
 
+JOB_NAME_PREFIX = "damage-detection-job"
+ACTIVE_JOB_STATUSES = ['SUBMITTED', 'PENDING', 'RUNNABLE', 'STARTING', 'RUNNING']
+
+def load_scaling_policy() -> dict:
+    """
+    Read the scaling bounds and throughput assumptions from the environment
+    """
+    return {
+        'min_jobs': int(os.environ.get('MIN_JOBS', 1)),
+        'max_jobs': int(os.environ.get('MAX_JOBS', 3)),
+        'target_drain_minutes': float(os.environ.get('TARGET_DRAIN_MINUTES', 30)),
+        'messages_per_job_per_minute': float(os.environ.get('MESSAGES_PER_JOB_PER_MINUTE', 10)),
+    }
+
+def desired_job_count(messages_available: int, messages_in_flight: int, policy: dict) -> int:
+    """
+    Number of concurrent jobs needed to drain the queue within the target drain time,
+    clamped to [min_jobs, max_jobs]. No jobs are needed when the queue is empty.
+    """
+    if messages_available == 0:
+        return 0
+    backlog = messages_available + messages_in_flight
+    messages_per_job = policy['messages_per_job_per_minute'] * policy['target_drain_minutes']
+    jobs = math.ceil(backlog / max(messages_per_job, 1))
+    return max(policy['min_jobs'], min(policy['max_jobs'], jobs))
+
+def count_active_jobs(batch, job_queue: str) -> int:
+    """
+    Count the jobs of this pipeline that are still queued or running, with one paginated listing per active status
+    """
+    # list_jobs accepts either a status or a single filter, so job names are matched here
+    paginator = batch.get_paginator('list_jobs')
+    return sum(
+        1
+        for status in ACTIVE_JOB_STATUSES
+        for page in paginator.paginate(jobQueue=job_queue, jobStatus=status)
+        for job in page.get('jobSummaryList', [])
+        if job.get('jobName', '').startswith(JOB_NAME_PREFIX)
+    )
+
+def get_queue_depth(sqs, queue_url: str) -> tuple[int, int]:
+    """
+    Return the number of available and in-flight messages in the queue
+    """
+    queue_attributes = sqs.get_queue_attributes(
+        QueueUrl=queue_url,
+        AttributeNames=['ApproximateNumberOfMessages', 'ApproximateNumberOfMessagesNotVisible']
+    )
+    attributes = queue_attributes['Attributes']
+    return (
+        int(attributes.get('ApproximateNumberOfMessages', 0)),
+        int(attributes.get('ApproximateNumberOfMessagesNotVisible', 0))
+    )
+
+def scale_jobs(sqs, batch, queue_url: str, job_queue: str, job_definition: str, policy: dict) -> dict:
+    """
+    Submit enough Batch jobs to reach the number of concurrent jobs the queue depth calls for
+    """
+    messages_available, messages_in_flight = get_queue_depth(sqs, queue_url)
+    print(f"Queue status - Available messages: {messages_available}, in flight: {messages_in_flight}")
+
+    if messages_available == 0:
+        print("No messages in queue, no action needed")
+        return {
+            'message': 'No messages in queue',
+            'messagesAvailable': messages_available,
+            'messagesInFlight': messages_in_flight
+        }
+
+    total_active_jobs = count_active_jobs(batch, job_queue)
+    desired_jobs = desired_job_count(messages_available, messages_in_flight, policy)
+    jobs_to_submit = max(0, desired_jobs - total_active_jobs)
+    print(f"Active batch jobs: {total_active_jobs}, desired: {desired_jobs}")
+
+    if jobs_to_submit == 0:
+        print(f"Batch jobs already running ({total_active_jobs}), no new job needed")
+        return {
+            'message': 'Batch jobs already running',
+            'activeJobs': total_active_jobs,
+            'desiredJobs': desired_jobs,
+            'messagesAvailable': messages_available,
+            'messagesInFlight': messages_in_flight
+        }
+
+    timestamp = int(datetime.now().timestamp())
+    submitted_jobs = []
+    for i in range(jobs_to_submit):
+        job_name = f"{JOB_NAME_PREFIX}-{timestamp}-{i}"
+        response = batch.submit_job(
+            jobName=job_name,
+            jobQueue=job_queue,
+            jobDefinition=job_definition
+        )
+        print(f"Submitted new batch job: {response['jobId']}")
+        submitted_jobs.append({'jobId': response['jobId'], 'jobName': job_name})
+
+    return {
+        'message': f'Submitted {len(submitted_jobs)} batch jobs',
+        'jobs': submitted_jobs,
+        'activeJobs': total_active_jobs,
+        'desiredJobs': desired_jobs,
+        'messagesAvailable': messages_available,
+        'messagesInFlight': messages_in_flight
+    }
+
+@timed_handler
 def lambda_handler(event, context):
     """
-    Lambda function that checks SQS queue for messages and triggers Batch jobs if needed.
+    Lambda function that checks SQS queue depth and submits Batch jobs proportionally to it.
     """
-    
-    sqs = boto3.client('sqs')
-    batch = boto3.client('batch')
-    
+
     queue_url = os.environ['SQS_QUEUE_URL']
     job_queue = os.environ['BATCH_JOB_QUEUE']
     job_definition = os.environ['BATCH_JOB_DEF']
-    
+
     try:
-        queue_attributes = sqs.get_queue_attributes(
-            QueueUrl=queue_url,
-            AttributeNames=['ApproximateNumberOfMessages']
+        result = scale_jobs(
+            get_client('sqs'),
+            get_client('batch'),
+            queue_url,
+            job_queue,
+            job_definition,
+            load_scaling_policy()
         )
-        
-        # Get message count (only available messages, not in-flight)
-        messages_available = int(queue_attributes['Attributes'].get('ApproximateNumberOfMessages', 0))
-        
-        print(f"Queue status - Available messages: {messages_available}")
-        
-        if messages_available == 0:
-            print("No messages in queue, no action needed")
-            return {
-                'statusCode': 200,
-                'body': json.dumps({
-                    'message': 'No messages in queue',
-                    'messagesAvailable': messages_available
-                })
-            }
-        
-        # Check if there are already running batch jobs
-        running_jobs = batch.list_jobs(
-            jobQueue=job_queue,
-            jobStatus='RUNNING'
-        )
-        
-        submitted_jobs = batch.list_jobs(
-            jobQueue=job_queue,
-            jobStatus='SUBMITTED'
-        )
-        
-        pending_jobs = batch.list_jobs(
-            jobQueue=job_queue,
-            jobStatus='PENDING'
-        )
-        
-        total_active_jobs = (len(running_jobs.get('jobList', [])) + 
-                           len(submitted_jobs.get('jobList', [])) + 
-                           len(pending_jobs.get('jobList', [])))
-        
-        print(f"Active batch jobs: {total_active_jobs}")
-        
-        # If there are messages but no active jobs, submit a new batch job
-        if total_active_jobs == 0:
-            job_name = f"damage-detection-job-{int(datetime.now().timestamp())}"
-            
-            response = batch.submit_job(
-                jobName=job_name,
-                jobQueue=job_queue,
-                jobDefinition=job_definition
-            )
-            
-            job_id = response['jobId']
-            print(f"Submitted new batch job: {job_id}")
-            
-            return {
-                'statusCode': 200,
-                'body': json.dumps({
-                    'message': 'Batch job submitted',
-                    'jobId': job_id,
-                    'jobName': job_name,
-                    'messagesAvailable': messages_available
-                })
-            }
-        else:
-            print(f"Batch jobs already running ({total_active_jobs}), no new job needed")
-            return {
-                'statusCode': 200,
-                'body': json.dumps({
-                    'message': 'Batch jobs already running',
-                    'activeJobs': total_active_jobs,
-                    'messagesAvailable': messages_available
-                })
-            }
-            
+        return {
+            'statusCode': 200,
+            'body': json.dumps(result)
+        }
+
     except Exception as e:
         print(f"Error monitoring batch jobs: {str(e)}")
         return {
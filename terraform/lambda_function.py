@@ -1,16 +1,17 @@
 import json
-import boto3
 import os
 from botocore.exceptions import ClientError
 import uuid
 from datetime import datetime
+from lambda_utils import get_client, timed_handler
 
+@timed_handler
 def lambda_handler(event, context):
     """
     Lambda function to generate presigned URLs for S3 uploads
     """
     
-    s3_client = boto3.client('s3')
+    s3_client = get_client('s3')
     
     bucket_name = os.environ.get('BUCKET_NAME')
     
@@ -0,0 +1,93 @@
+import os
+import json
+import time
+import functools
+
+def process_started_at() -> float:
+    """
+    perf_counter() value at which this process started, so the init time includes
+    the imports of boto3/botocore done by the handler modules before this one.
+    Falls back to now if /proc is not available.
+    """
+    now = time.perf_counter()
+    try:
+        with open('/proc/self/stat') as f:
+            # Field 22 (start time in clock ticks since boot), counted after the parenthesized command name
+            start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        return now - max(0.0, uptime - start_ticks / os.sysconf('SC_CLK_TCK'))
+    except (OSError, ValueError, IndexError):
+        return now
+
+INIT_STARTED_AT = process_started_at()
+
+import boto3
+import urllib3
+
+# Module scope survives between invocations of a warm Lambda container, so clients
+# and connection pools created here are reused instead of rebuilt on every request
+HTTP_POOL_SIZE = 10
+HTTP_TIMEOUT = urllib3.Timeout(connect=5.0, read=25.0)
+
+_clients = {}
+_http = None
+_cold_start = True
+
+def get_client(service_name: str):
+    """
+    Return a boto3 client for the service, creating it on first use
+    """
+    if service_name not in _clients:
+        _clients[service_name] = boto3.client(service_name)
+    return _clients[service_name]
+
+def get_http() -> urllib3.PoolManager:
+    """
+    Return the keep-alive HTTP connection pool shared by all invocations
+    """
+    global _http
+    if _http is None:
+        _http = urllib3.PoolManager(maxsize=HTTP_POOL_SIZE, timeout=HTTP_TIMEOUT, retries=False)
+    return _http
+
+def supabase_rpc(supabase_url: str, supabase_key: str, endpoint: str, payload: dict):
+    """
+    POST a JSON payload to a Supabase RPC endpoint over a pooled connection
+    Returns the urllib3 response, whose status must be checked by the caller
+    """
+    return get_http().request(
+        'POST',
+        f"{supabase_url}{endpoint}",
+        body=json.dumps(payload).encode('utf-8'),
+        headers={
+            'Content-Type': 'application/json',
+            'Authorization': f'Bearer {supabase_key}',
+            'apikey': supabase_key
+        }
+    )
+
+def timed_handler(handler):
+    """
+    Decorator that logs how long the container took to initialize (on cold starts)
+    and how long each invocation of the handler took
+    """
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        global _cold_start
+        cold_start = _cold_start
+        _cold_start = False
+        started_at = time.perf_counter()
+        try:
+            return handler(event, context)
+        finally:
+            timing = {
+                'metric': 'lambda_timing',
+                'function': getattr(context, 'function_name', handler.__module__),
+                'cold_start': cold_start,
+                'handler_ms': round((time.perf_counter() - started_at) * 1000, 2)
+            }
+            if cold_start:
+                timing['init_ms'] = round((started_at - INIT_STARTED_AT) * 1000, 2)
+            print(json.dumps(timing))
+    return wrapper
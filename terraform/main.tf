@@ -500,6 +500,10 @@ data "archive_file" "lambda_presigned_url_zip" {
     })
     filename = "lambda_function.py"
   }
+  source {
+    content  = file("${path.module}/lambda_utils.py")
+    filename = "lambda_utils.py"
+  }
 }
 
 # Lambda function for generating presigned URLs
@@ -665,6 +669,10 @@ data "archive_file" "lambda_report_validation_zip" {
     content  = file("${path.module}/report_validation_lambda.py")
     filename = "lambda_function.py"
   }
+  source {
+    content  = file("${path.module}/lambda_utils.py")
+    filename = "lambda_utils.py"
+  }
 }
 
 # Lambda function for validating damage reports
@@ -778,6 +786,10 @@ data "archive_file" "lambda_report_get_zip" {
     content  = file("${path.module}/report_get_lambda.py")
     filename = "lambda_function.py"
   }
+  source {
+    content  = file("${path.module}/lambda_utils.py")
+    filename = "lambda_utils.py"
+  }
 }
 
 # Lambda function for getting report details
@@ -923,6 +935,7 @@ resource "aws_iam_policy" "aws_batch_task_policy" {
         Action = [
           "sqs:ReceiveMessage",
           "sqs:DeleteMessage",
+          "sqs:ChangeMessageVisibility",
           "sqs:GetQueueAttributes",
           "sqs:SendMessage"
         ]
@@ -1163,6 +1176,10 @@ data "archive_file" "lambda_batch_monitor_zip" {
     content  = file("${path.module}/batch_monitor.py")
     filename = "lambda_function.py"
   }
+  source {
+    content  = file("${path.module}/lambda_utils.py")
+    filename = "lambda_utils.py"
+  }
 }
 
 # Lambda function for monitoring SQS and triggering Batch jobs
@@ -1178,9 +1195,13 @@ resource "aws_lambda_function" "batch_monitor_lambda" {
 
   environment {
     variables = {
-      SQS_QUEUE_URL      = aws_sqs_queue.request_queue.url
-      BATCH_JOB_QUEUE    = aws_batch_job_queue.batch_job_queue.name
-      BATCH_JOB_DEF      = aws_batch_job_definition.batch_job_definition.name
+      SQS_QUEUE_URL               = aws_sqs_queue.request_queue.url
+      BATCH_JOB_QUEUE             = aws_batch_job_queue.batch_job_queue.name
+      BATCH_JOB_DEF               = aws_batch_job_definition.batch_job_definition.name
+      MIN_JOBS                    = var.batch_min_jobs
+      MAX_JOBS                    = var.batch_max_jobs
+      TARGET_DRAIN_MINUTES        = var.batch_target_drain_minutes
+      MESSAGES_PER_JOB_PER_MINUTE = var.batch_messages_per_job_per_minute
     }
   }
 
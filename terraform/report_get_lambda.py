@@ -1,14 +1,16 @@
 import json
 import os
-import urllib.request
-import urllib.parse
-import boto3
+from concurrent.futures import ThreadPoolExecutor
 from botocore.exceptions import ClientError
 from typing import List, Dict, Any, Optional
+from lambda_utils import get_client, supabase_rpc, timed_handler
 
 SUPABASE_RPC_ENDPOINT = "/rest/v1/rpc/get_report_details"
+SUPABASE_BATCH_RPC_ENDPOINT = "/rest/v1/rpc/get_reports_details"
+MAX_CONCURRENT_REQUESTS = 10
 DEFAULT_SCORE_THRESHOLD = 0.38
 
+@timed_handler
 def lambda_handler(event, context):
     supabase_url = os.environ.get('SUPABASE_URL')
     supabase_key = os.environ.get('SUPABASE_KEY')
@@ -54,26 +56,24 @@ def lambda_handler(event, context):
             }
         
         reports = []
-        s3_client = boto3.client('s3')
+        s3_client = get_client('s3')
         
-        for uuid in report_uuids:
-            report_data = get_report_from_supabase(supabase_url, supabase_key, uuid)
-            if report_data:
-                # Generate presigned URL for the image
-                image_name = report_data.get('image_name')
-                if image_name and image_name.strip():
-                    presigned_url = generate_presigned_url(s3_client, bucket_name, image_name)
-                    if presigned_url:
-                        report_data['image_url'] = presigned_url
-                    if 'image_name' in report_data:
-                        del report_data['image_name']
-                else:
-                    if 'image_name' in report_data:
-                        del report_data['image_name']
-                
-                processed_objects = process_objects(report_data.get('objects', []), score_threshold)
-                report_data['objects'] = processed_objects
-                reports.append(report_data)
+        for report_data in get_reports_from_supabase(supabase_url, supabase_key, report_uuids):
+            # Generate presigned URL for the image
+            image_name = report_data.get('image_name')
+            if image_name and image_name.strip():
+                presigned_url = generate_presigned_url(s3_client, bucket_name, image_name)
+                if presigned_url:
+                    report_data['image_url'] = presigned_url
+                if 'image_name' in report_data:
+                    del report_data['image_name']
+            else:
+                if 'image_name' in report_data:
+                    del report_data['image_name']
+            
+            processed_objects = process_objects(report_data.get('objects', []), score_threshold)
+            report_data['objects'] = processed_objects
+            reports.append(report_data)
         
         if not reports:
             return {
@@ -136,27 +136,40 @@ def extract_report_uuids(event: Dict[str, Any]) -> List[str]:
     return list(set([uuid.strip() for uuid in uuids if uuid and uuid.strip()]))
 
 
-def get_report_from_supabase(supabase_url: str, supabase_key: str, report_uuid: str) -> Optional[Dict[str, Any]]:
+def get_reports_from_supabase(supabase_url: str, supabase_key: str, report_uuids: List[str]) -> List[Dict[str, Any]]:
+    """
+    Fetch all reports with a single call to the get_reports_details RPC.
+    
+    Falls back to concurrent get_report_details calls if the batched RPC is not available.
+    """
     try:
-        rpc_url = f"{supabase_url}{SUPABASE_RPC_ENDPOINT}"
-        payload = {"report_uuid_param": report_uuid}
-        data = json.dumps(payload).encode('utf-8')
+        payload = {"report_uuids": report_uuids}
+        response = supabase_rpc(supabase_url, supabase_key, SUPABASE_BATCH_RPC_ENDPOINT, payload)
         
-        request = urllib.request.Request(
-            rpc_url,
-            data=data,
-            headers={
-                'Content-Type': 'application/json',
-                'Authorization': f'Bearer {supabase_key}',
-                'apikey': supabase_key
-            },
-            method='POST'
-        )
+        if response.status == 200:
+            response_data = json.loads(response.data.decode('utf-8'))
+            reports_by_uuid = {report['report_uuid']: report for report in response_data or [] if report}
+            return [reports_by_uuid[uuid] for uuid in report_uuids if uuid in reports_by_uuid]
+        print(f"Batched Supabase RPC failed with status {response.status}, falling back to per report requests")
         
-        response = urllib.request.urlopen(request)
+    except Exception as e:
+        print(f"Error calling batched Supabase RPC: {str(e)}, falling back to per report requests")
+    
+    with ThreadPoolExecutor(max_workers=min(MAX_CONCURRENT_REQUESTS, len(report_uuids))) as executor:
+        reports = executor.map(
+            lambda uuid: get_report_from_supabase(supabase_url, supabase_key, uuid),
+            report_uuids
+        )
+        return [report for report in reports if report]
+
+
+def get_report_from_supabase(supabase_url: str, supabase_key: str, report_uuid: str) -> Optional[Dict[str, Any]]:
+    try:
+        payload = {"report_uuid_param": report_uuid}
+        response = supabase_rpc(supabase_url, supabase_key, SUPABASE_RPC_ENDPOINT, payload)
         
         if response.status == 200:
-            response_data = json.loads(response.read().decode('utf-8'))
+            response_data = json.loads(response.data.decode('utf-8'))
             return response_data if response_data else None
         else:
             print(f"Supabase RPC call failed with status {response.status}")
@@ -1,18 +1,17 @@
 import json
 import uuid
-import boto3
 import os
 import re
-import urllib.request
-import urllib.parse
 from datetime import datetime, timedelta
 from botocore.exceptions import ClientError
+from lambda_utils import get_client, supabase_rpc, timed_handler
 
 REPORT_UUID_LENGTH = 8
 SUPABASE_REPORT_ENDPOINT = "/rest/v1/rpc/insert_report"
 DESCRIPTION_MAX_LEN = 480
 ADDRESS_MAX_LEN = 480
 
+@timed_handler
 def lambda_handler(event, context):
     """
     Lambda function to validate and process new damage reports
@@ -29,8 +28,8 @@ def lambda_handler(event, context):
     }
     """
     
-    s3_client = boto3.client('s3')
-    sqs_client = boto3.client('sqs')
+    s3_client = get_client('s3')
+    sqs_client = get_client('sqs')
     
     bucket_name = os.environ.get('BUCKET_NAME')
     queue_url = os.environ.get('SQS_QUEUE_URL')
@@ -258,30 +257,13 @@ def call_supabase_rpc(supabase_url, supabase_key, report_data):
         if 'description' in report_data:
             rpc_payload['description'] = report_data['description']
         
-        # Supabase RPC endpoint
-        rpc_url = f"{supabase_url}{SUPABASE_REPORT_ENDPOINT}"
-        
-        # Prepare the request
-        data = json.dumps(rpc_payload).encode('utf-8')
-        
-        request = urllib.request.Request(
-            rpc_url,
-            data=data,
-            headers={
-                'Content-Type': 'application/json',
-                'Authorization': f'Bearer {supabase_key}',
-                'apikey': supabase_key
-            },
-            method='POST'
-        )
-        
-        response = urllib.request.urlopen(request)
+        response = supabase_rpc(supabase_url, supabase_key, SUPABASE_REPORT_ENDPOINT, rpc_payload)
         
         if response.status == 200:
             print(f"Successfully called Supabase RPC for report {report_data['report_uuid']}")
             return True
         else:
-            print(f"Supabase RPC call failed with status {response.status}: {response.read().decode('utf-8')}")
+            print(f"Supabase RPC call failed with status {response.status}: {response.data.decode('utf-8')}")
             return False
             
     except Exception as e:
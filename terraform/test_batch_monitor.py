@@ -0,0 +1,92 @@
+import json
+import unittest
+from unittest import mock
+
+import boto3
+from botocore.stub import Stubber
+
+import batch_monitor
+
+QUEUE_URL = "https://sqs.us-east-1.amazonaws.com/123456789012/reports"
+JOB_QUEUE = "damage-detection-queue"
+JOB_DEFINITION = "damage-detection-job-def"
+
+class BatchMonitorTest(unittest.TestCase):
+    def setUp(self):
+        self.sqs = boto3.client('sqs', region_name='us-east-1', aws_access_key_id='test', aws_secret_access_key='test')
+        self.batch = boto3.client('batch', region_name='us-east-1', aws_access_key_id='test', aws_secret_access_key='test')
+        self.sqs_stub = Stubber(self.sqs)
+        self.batch_stub = Stubber(self.batch)
+        self.addCleanup(self.sqs_stub.deactivate)
+        self.addCleanup(self.batch_stub.deactivate)
+
+    def stub_queue_depth(self, available: int, in_flight: int):
+        self.sqs_stub.add_response(
+            'get_queue_attributes',
+            {'Attributes': {
+                'ApproximateNumberOfMessages': str(available),
+                'ApproximateNumberOfMessagesNotVisible': str(in_flight)
+            }},
+            {'QueueUrl': QUEUE_URL, 'AttributeNames': ['ApproximateNumberOfMessages', 'ApproximateNumberOfMessagesNotVisible']}
+        )
+
+    def stub_active_jobs(self, jobs_by_status: dict):
+        """One listing per status, with the RUNNING jobs split over two pages"""
+        for status in batch_monitor.ACTIVE_JOB_STATUSES:
+            jobs = [
+                {'jobArn': f"arn:{name}", 'jobId': name, 'jobName': name, 'status': status}
+                for name in jobs_by_status.get(status, [])
+            ]
+            pages = [jobs[:1], jobs[1:]] if status == 'RUNNING' and len(jobs) > 1 else [jobs]
+            for i, page in enumerate(pages):
+                expected = {'jobQueue': JOB_QUEUE, 'jobStatus': status}
+                response = {'jobSummaryList': page}
+                if i > 0:
+                    expected['nextToken'] = 'page-2'
+                if i < len(pages) - 1:
+                    response['nextToken'] = 'page-2'
+                self.batch_stub.add_response('list_jobs', response, expected)
+
+    def test_count_active_jobs_lists_each_status_and_matches_prefix(self):
+        self.stub_active_jobs({
+            'RUNNING': ['damage-detection-job-1-0', 'damage-detection-job-1-1', 'other-job'],
+            'RUNNABLE': ['damage-detection-job-2-0'],
+        })
+        with self.batch_stub:
+            self.assertEqual(batch_monitor.count_active_jobs(self.batch, JOB_QUEUE), 3)
+        self.batch_stub.assert_no_pending_responses()
+
+    def test_handler_submits_jobs_for_queue_depth(self):
+        self.stub_queue_depth(available=1000, in_flight=0)
+        self.stub_active_jobs({'RUNNING': ['damage-detection-job-1-0']})
+        for _ in range(2):
+            self.batch_stub.add_response('submit_job', {'jobId': 'new', 'jobName': 'new'})
+
+        environment = {
+            'SQS_QUEUE_URL': QUEUE_URL,
+            'BATCH_JOB_QUEUE': JOB_QUEUE,
+            'BATCH_JOB_DEF': JOB_DEFINITION,
+            'MAX_JOBS': '3',
+        }
+        clients = {'sqs': self.sqs, 'batch': self.batch}
+        with self.sqs_stub, self.batch_stub, \
+                mock.patch.dict('os.environ', environment), \
+                mock.patch.object(batch_monitor, 'get_client', clients.get):
+            response = batch_monitor.lambda_handler({}, None)
+
+        self.assertEqual(response['statusCode'], 200)
+        body = json.loads(response['body'])
+        self.assertEqual((body['activeJobs'], body['desiredJobs'], len(body['jobs'])), (1, 3, 2))
+        self.batch_stub.assert_no_pending_responses()
+
+    def test_handler_skips_listing_when_queue_is_empty(self):
+        self.stub_queue_depth(available=0, in_flight=4)
+        with self.sqs_stub, self.batch_stub, \
+                mock.patch.dict('os.environ', {'SQS_QUEUE_URL': QUEUE_URL, 'BATCH_JOB_QUEUE': JOB_QUEUE, 'BATCH_JOB_DEF': JOB_DEFINITION}), \
+                mock.patch.object(batch_monitor, 'get_client', {'sqs': self.sqs, 'batch': self.batch}.get):
+            response = batch_monitor.lambda_handler({}, None)
+        self.assertEqual(response['statusCode'], 200)
+        self.assertEqual(json.loads(response['body'])['message'], 'No messages in queue')
+
+if __name__ == '__main__':
+    unittest.main()
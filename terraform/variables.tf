@@ -33,6 +33,30 @@ variable "batch_memory" {
   default     = 2048
 }
 
+variable "batch_min_jobs" {
+  description = "Minimum number of concurrent AWS Batch jobs while the queue has messages"
+  type        = number
+  default     = 1
+}
+
+variable "batch_max_jobs" {
+  description = "Maximum number of concurrent AWS Batch jobs submitted by the batch monitor"
+  type        = number
+  default     = 3
+}
+
+variable "batch_target_drain_minutes" {
+  description = "Time in minutes the batch monitor sizes the number of jobs to drain the queue in"
+  type        = number
+  default     = 30
+}
+
+variable "batch_messages_per_job_per_minute" {
+  description = "Estimated number of messages a single AWS Batch job processes per minute"
+  type        = number
+  default     = 10
+}
+
 variable "batch_environment_variables" {
   description = "Additional environment variables for AWS Batch jobs"
   type = list(object({